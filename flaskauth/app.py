@@ -1,31 +1,190 @@
-from flask import Flask, render_template, redirect, url_for, request
+from flask import Blueprint, Flask, current_app, render_template, redirect, url_for, request
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin, login_user, LoginManager, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, FloatField, RadioField, SelectField, DateTimeField, DateTimeLocalField, IntegerField
-from wtforms.validators import InputRequired, Length, ValidationError, DataRequired, EqualTo, NumberRange
+from flask_wtf.csrf import validate_csrf
+from wtforms import HiddenField, StringField, PasswordField, SubmitField, FloatField, RadioField, SelectField, DateTimeField, DateTimeLocalField, IntegerField
+from wtforms.validators import Optional, InputRequired, Length, ValidationError, DataRequired, EqualTo, NumberRange
 from wtforms_components import DateField
 from flask_bcrypt import Bcrypt
-from datetime import datetime
+from datetime import datetime, timedelta, date, timezone
 from flask import flash
 from flask import abort
 from flask import session
+from flask import g, jsonify, Response, stream_with_context, send_file
+from flask.sessions import SecureCookieSessionInterface
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import configure_mappers, make_transient_to_detached
+from sqlalchemy.orm.attributes import flag_modified
+from collections import Counter, OrderedDict, deque
+from functools import wraps
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from workout_plans import WORKOUT_PLANS
+from instrumentation import init_instrumentation, metrics
+import click
+import numpy as np
+import csv
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import math
+import mimetypes
+import multiprocessing
+import os
+import re
+import secrets
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+try:
+    import brotli  # optional, without it everything is served gzip only
+except ImportError:
+    brotli = None
+
+DEFAULT_CONFIG = {}  # copied into every app create_app() builds, each section below adds its own settings
+bp = Blueprint('kickstart', __name__, cli_group=None)  # every route and cli command, create_app() registers it
+DEFAULT_CONFIG['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))  # raising this rehashes users as they log in
+DEFAULT_CONFIG['HASH_POOL_WORKERS'] = int(os.environ.get('HASH_POOL_WORKERS', os.cpu_count() or 2))
+DEFAULT_CONFIG['HASH_QUEUE_SIZE'] = int(os.environ.get('HASH_QUEUE_SIZE', 32))  # hashes running or waiting before logins get a 503
+DEFAULT_CONFIG['HASH_QUEUE_TIMEOUT'] = 2.0  # seconds a request waits for a queue slot
+bcrypt = Bcrypt()  # the extensions are bound to the app in create_app()
+
+def database_uri():
+    uri = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
+    if uri.startswith('postgres://'):  # heroku style urls, sqlalchemy only knows the postgresql:// name
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+def engine_options(uri):
+    if uri.startswith('sqlite'):
+        # sqlite gets its concurrency from WAL and busy_timeout (see set_sqlite_pragmas), not from pool sizing
+        return {'connect_args': {'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)) / 1000}}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),  # drop connections before the server or a proxy does
+        'pool_pre_ping': True,
+    }
 
-app = Flask(__name__)   #declares as an application file
-bcrypt = Bcrypt(app)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
-app.config['SECRET_KEY'] = 'thisisasecret key'
-app.config['TEMPLATES_AUTO_RELOAD'] = True
-
-db = SQLAlchemy(app)     #declares SQLAlchemy as database
+DEFAULT_CONFIG['SQLALCHEMY_DATABASE_URI'] = database_uri()
+DEFAULT_CONFIG['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(DEFAULT_CONFIG['SQLALCHEMY_DATABASE_URI'])
+DEFAULT_CONFIG['SECRET_KEY'] = None  # set from the SECRET_KEY environment variable in create_app()
+DEFAULT_CONFIG['TEMPLATES_AUTO_RELOAD'] = None  # None follows debug mode, so production never stats templates per request
+DEFAULT_CONFIG['SCHEMA_AUTO_INIT'] = True  # create/upgrade the schema on the first request, gunicorn.conf.py does it once up front instead
+
+db = SQLAlchemy()     #declares SQLAlchemy as database
+
+@db.event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # applied to every new connection: WAL lets readers carry on while a log is being written,
+    # synchronous=NORMAL is still crash safe under WAL and saves an fsync per commit
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=%d' % int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)))
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA cache_size=-%d' % int(os.environ.get('SQLITE_CACHE_KB', 20000)))
+    cursor.close()
+
+DEFAULT_CONFIG['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+DEFAULT_CONFIG['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+DEFAULT_CONFIG['PROFILER_ENABLED'] = os.environ.get('PROFILER_ENABLED') == '1'
 
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = "login"
+login_manager.login_view = "kickstart.login"
+
+DEFAULT_CONFIG['USER_CACHE_TTL'] = 300      # seconds, 0 turns the cache off. safe with any number of workers, see load_user
+DEFAULT_CONFIG['USER_CACHE_SIZE'] = 10000
+DEFAULT_CONFIG['USER_CACHE_BACKEND'] = None  # anything with get/set/delete, e.g. a redis wrapper shared between workers
+
+class LRUCache: #small thread safe in-process cache, entries expire after ttl seconds
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+APP_CACHES = {}  # name -> LRUCache arguments, every app gets its own set since what they hold comes from its database
+
+def app_state():
+    # the caches, rate limit store and schema flag of the app handling this request, see create_app
+    return current_app.extensions['kickstart']
+
+def app_cache(name):
+    return app_state().caches[name]
+
+def schema_required(command):
+    # cli commands run in their own process, possibly against a database nothing has set up yet
+    @wraps(command)
+    def wrapper(*args, **kwargs):
+        lazy_init_schema()
+        return command(*args, **kwargs)
+    return wrapper
+
+def get_user_cache():
+    return current_app.config['USER_CACHE_BACKEND'] or app_state().caches['user']
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # every logged in request comes through here, so serve the user from the cache instead of loading the row.
+    # an in-process copy is only used while the user's 'user' cache version matches the one it was stored
+    # with, any process that writes the user bumps it (see invalidate_cached_user). a shared backend gets
+    # the deletes directly and skips that lookup
+    user_id = int(user_id)
+    if not current_app.config['USER_CACHE_TTL']:
+        return db.session.get(User, user_id)
+    cache = get_user_cache()
+    version = None if current_app.config['USER_CACHE_BACKEND'] else get_cache_versions('user', user_id)[0]
+    cached = cache.get(user_id)
+    if cached is not None and cached['version'] == version:
+        user = User(**cached['columns'])
+        make_transient_to_detached(user)  # attaches as a persistent row without a SELECT, password stays unloaded
+        return db.session.merge(user, load=False)
+    user = db.session.get(User, user_id)  # read after the version, so a concurrent write can only make the copy look older
+    if user is not None:
+        cache.set(user_id, {'version': version, 'columns': {column: getattr(user, column) for column in USER_CACHE_COLUMNS}})
+    return user
 
 class User(db.Model, UserMixin): #db model for the user
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -35,9 +194,22 @@ class User(db.Model, UserMixin): #db model for the user
     bmi_date = db.Column(db.DateTime)
     tdee = db.Column(db.Float)
     tdee_date = db.Column(db.DateTime)
+    sync_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # last change version handed out to this user's logs
+    sync_floor = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # tombstones at or below this version have been purged
     food_log = db.relationship('FoodLog', backref='user', lazy=True)
     workout_log = db.relationship('WorkoutLog', backref='user', lazy=True)
 
+# keep hashes out of shared caches, and the sync counters too since those are bumped with plain UPDATEs on every log write
+USER_CACHE_COLUMNS = [column for column in User.__table__.columns.keys() if column not in ('password', 'sync_version', 'sync_floor')]
+
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def invalidate_cached_user(mapper, connection, user):
+    # any write to bmi, tdee, password etc. drops this process's cached copy, and the version bump in the same
+    # transaction makes every other worker reload it on its next request
+    get_user_cache().delete(user.id)
+    bump_cache_version('user', user.id, connection)
+
 class FoodLog(db.Model): #db model for the food log 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -48,7 +220,15 @@ class FoodLog(db.Model): #db model for the food log
     carbs = db.Column(db.Float, nullable=False)
     fats = db.Column(db.Float, nullable=False)
     log_date = db.Column(db.DateTime, default=datetime.utcnow)
-    
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # see stamp_sync_versions
+    updated_at = db.Column(db.DateTime)
+    deleted_at = db.Column(db.DateTime)  # deletes leave a tombstone so syncing clients find out about them
+    archived = False  # rows read back from a LogArchive block say True
+
+    # history pages walk a user's logs newest first, so the index matches that order
+    __table_args__ = (db.Index('ix_food_log_user_date', 'user_id', 'log_date', 'id'),
+                      db.Index('ix_food_log_user_version', 'user_id', 'version', 'id'))
+
 
 class WorkoutLog(db.Model): #db model for the workout log
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -57,6 +237,593 @@ class WorkoutLog(db.Model): #db model for the workout log
     duration = db.Column(db.Float, nullable=False)
     intensity = db.Column(db.String(50), nullable=False)
     log_date = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime)
+    deleted_at = db.Column(db.DateTime)
+    archived = False
+
+    __table_args__ = (db.Index('ix_workout_log_user_date', 'user_id', 'log_date', 'id'),
+                      db.Index('ix_workout_log_user_version', 'user_id', 'version', 'id'))
+
+SYNCED_MODELS = (FoodLog, WorkoutLog)
+
+def allocate_sync_version(connection, user_id):
+    # the UPDATE takes the user's row lock, so versions come out in commit order and a client that has
+    # seen version N never misses a later commit carrying a version <= N
+    users = User.__table__
+    connection.execute(users.update().where(users.c.id == user_id).values(sync_version=users.c.sync_version + 1))
+    return connection.execute(db.select(users.c.sync_version).where(users.c.id == user_id)).scalar_one()
+
+@db.event.listens_for(db.session, 'before_flush')
+def stamp_sync_versions(session, flush_context, instances):
+    # every ORM write to a log row gets the user's next version, one version per user per flush
+    changed = [obj for obj in session.new if isinstance(obj, SYNCED_MODELS)]
+    changed += [obj for obj in session.dirty if isinstance(obj, SYNCED_MODELS) and session.is_modified(obj)]
+    if not changed:
+        return
+    now = datetime.utcnow()
+    versions = {}
+    for log in changed:
+        if log.user_id not in versions:
+            versions[log.user_id] = allocate_sync_version(session.connection(), log.user_id)
+        log.version = versions[log.user_id]
+        # a client supplied updated_at (last writer wins) is kept, anything else is stamped with the server clock
+        if log.updated_at is None or not db.inspect(log).attrs.updated_at.history.has_changes():
+            log.updated_at = now
+
+
+class DailySummary(db.Model): #one row per user per day, kept in step with the food and workout logs
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    calories = db.Column(db.Float, nullable=False, default=0)
+    protein = db.Column(db.Float, nullable=False, default=0)
+    carbs = db.Column(db.Float, nullable=False, default=0)
+    fats = db.Column(db.Float, nullable=False, default=0)
+    food_entries = db.Column(db.Integer, nullable=False, default=0)
+    workout_minutes = db.Column(db.Float, nullable=False, default=0)
+    workout_entries = db.Column(db.Integer, nullable=False, default=0)
+    low_minutes = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    medium_minutes = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    high_minutes = db.Column(db.Float, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'day', name='uq_daily_summary_user_day'),)
+
+INTENSITY_MINUTES = {'Low': 'low_minutes', 'Medium': 'medium_minutes', 'High': 'high_minutes'}
+
+class FoodItem(db.Model): #per 100g nutrition for the food catalog, bundled foods have no user_id
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    name = db.Column(db.String(100), nullable=False)
+    calories = db.Column(db.Float, nullable=False)
+    protein = db.Column(db.Float, nullable=False)
+    carbs = db.Column(db.Float, nullable=False)
+    fats = db.Column(db.Float, nullable=False)
+    source = db.Column(db.String(20), nullable=False, default='bundled')  # 'bundled' or 'user'
+
+    __table_args__ = (db.Index('ix_food_item_user_name', 'user_id', 'name'),)
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name, 'calories': self.calories, 'protein': self.protein,
+                'carbs': self.carbs, 'fats': self.fats, 'source': self.source}
+
+
+class FoodItemTerm(db.Model): #one row per word of a food name, the primary key doubles as the prefix search index
+    term = db.Column(db.String(100), primary_key=True)
+    food_item_id = db.Column(db.Integer, db.ForeignKey('food_item.id'), primary_key=True)
+
+class Job(db.Model): #background job queue, workers claim queued rows (see run_worker)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(50), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    dedupe_key = db.Column(db.String(200))
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_job_status_run_after', 'status', 'run_after'),
+                      # at most one queued job per dedupe key, so two requests racing to enqueue the same work can't both win
+                      db.Index('uq_job_dedupe_queued', 'dedupe_key', unique=True,
+                               sqlite_where=db.text("status = 'queued'"), postgresql_where=db.text("status = 'queued'")))
+
+    def to_dict(self):
+        return {'id': self.id, 'kind': self.kind, 'status': self.status, 'attempts': self.attempts,
+                'result': json.loads(self.result) if self.result else None, 'error': self.error,
+                'created_at': self.created_at.isoformat(), 'updated_at': self.updated_at.isoformat()}
+
+class LogArchive(db.Model): #one compressed block of a user's food or workout logs for one month, see archive_logs
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    log_type = db.Column(db.String(20), nullable=False)  # food_log or workout_log
+    month = db.Column(db.Date, nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+    first_date = db.Column(db.DateTime, nullable=False)
+    last_date = db.Column(db.DateTime, nullable=False)
+    summary = db.Column(db.Text, nullable=False)  # json, per day totals in DailySummary's column names
+    data = db.deferred(db.Column(db.LargeBinary, nullable=False))  # zlib compressed columnar json of the rows
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'log_type', 'month', name='uq_log_archive_user_type_month'),)
+
+    def rows(self):
+        return decode_archive_rows(self.data)
+
+class ApiToken(db.Model): #bearer tokens for the json api, only a sha256 of each token is stored
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    token_hash = db.Column(db.String(64), nullable=False, unique=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime)
+
+class CacheVersion(db.Model): #counters that in-process caches put in their keys, user_id 0 is for data shared by everybody
+    # they live in the database because a write can come from any worker process, a job worker or the cli
+    name = db.Column(db.String(50), primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+def upsert_increment(table, keys, deltas, connection=None):
+    # INSERT ... ON CONFLICT DO UPDATE SET column = column + delta, one statement that can't lose a concurrent
+    # update or trip over the unique key when two requests create the row at the same time. flush events
+    # pass their connection, the session can't execute statements while it is flushing
+    upsert_increments(table, list(keys), [{**keys, **deltas}], connection)
+
+def upsert_increments(table, key_columns, rows, connection=None):
+    # the same for many rows in one multi row statement. every row has the same columns and no two share a key
+    executor = connection or db.session
+    insert = sqlite_insert if (connection or db.session.get_bind()).dialect.name == 'sqlite' else postgresql_insert
+    statement = insert(table).values(rows)
+    statement = statement.on_conflict_do_update(index_elements=list(key_columns),
+                                                set_={column: table.c[column] + statement.excluded[column]
+                                                      for column in rows[0] if column not in key_columns})
+    executor.execute(statement)
+
+def bump_cache_version(name, user_id=0, connection=None):
+    # part of the caller's transaction, so the new version is visible exactly when the data it covers is
+    upsert_increment(CacheVersion.__table__, {'name': name, 'user_id': user_id}, {'version': 1}, connection)
+
+def get_cache_versions(name, *user_ids):
+    rows = db.session.query(CacheVersion.user_id, CacheVersion.version).filter(CacheVersion.name == name,
+                                                                              CacheVersion.user_id.in_(user_ids))
+    versions = dict(rows.all())
+    return tuple(versions.get(user_id, 0) for user_id in user_ids)
+
+class Assessment(db.Model): #saved personal assessment, one row per distinct set of inputs per user
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    input_hash = db.Column(db.String(64), nullable=False)
+    plan_version = db.Column(db.Integer, nullable=False)
+    age = db.Column(db.Integer, nullable=False)
+    current_weight = db.Column(db.Float, nullable=False)
+    goal_weight = db.Column(db.Float, nullable=False)
+    training_preference = db.Column(db.String(20), nullable=False)
+    tdee = db.Column(db.Float)
+    plan = db.Column(db.Text, nullable=False)  # json snapshot of generate_workout_plan's result
+    submissions = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_submitted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'input_hash', name='uq_assessment_user_hash'),
+                      db.Index('ix_assessment_user_created', 'user_id', 'created_at', 'id'))
+
+    def get_plan(self):
+        return json.loads(self.plan)
+
+def log_day(log):
+    return (log.log_date or datetime.utcnow()).date()
+
+def new_daily_summary(user_id, day):
+    return DailySummary(user_id=user_id, day=day, calories=0, protein=0, carbs=0, fats=0, food_entries=0,
+                        workout_minutes=0, workout_entries=0, low_minutes=0, medium_minutes=0, high_minutes=0)
+
+# the entries counter and the totals it covers for each log type
+SUMMARY_COLUMNS = {FoodLog: ('food_entries', ('calories', 'protein', 'carbs', 'fats')),
+                   WorkoutLog: ('workout_entries', ('workout_minutes', *INTENSITY_MINUTES.values()))}
+
+def add_to_daily_summaries(model, user_id, changes):
+    # changes is a list of (day, deltas), summed per day and sent as one upsert. the database adds the
+    # deltas, so two requests logging the same day can't overwrite each other
+    entries_column, reset_columns = SUMMARY_COLUMNS[model]
+    totals = {}
+    emptied = set()
+    for day, deltas in changes:
+        total = totals.setdefault(day, dict.fromkeys((entries_column, *reset_columns), 0))
+        for column, value in deltas.items():
+            total[column] += value
+        if deltas[entries_column] < 0:
+            emptied.add(day)
+    if not totals:
+        return
+    upsert_increments(DailySummary.__table__, ('user_id', 'day'),
+                      [{'user_id': user_id, 'day': day, **total} for day, total in totals.items()])
+    if emptied:  # stops float drift building up on days that are empty again
+        DailySummary.query.filter(DailySummary.user_id == user_id, DailySummary.day.in_(emptied),
+                                  getattr(DailySummary, entries_column) == 0
+                                  ).update(dict.fromkeys(reset_columns, 0), synchronize_session=False)
+    bump_cache_version('summaries', user_id)
+
+# sign is 1 when a log is added and -1 when it is removed, an edit is a remove followed by an add
+def food_summary_change(food_log, sign=1):
+    return log_day(food_log), {'calories': sign * food_log.calories, 'protein': sign * food_log.protein,
+                               'carbs': sign * food_log.carbs, 'fats': sign * food_log.fats, 'food_entries': sign}
+
+def workout_summary_change(workout, sign=1):
+    deltas = {'workout_minutes': sign * workout.duration, 'workout_entries': sign}
+    intensity_column = INTENSITY_MINUTES.get(workout.intensity)
+    if intensity_column:
+        deltas[intensity_column] = sign * workout.duration
+    return log_day(workout), deltas
+
+SUMMARY_CHANGES = {FoodLog: food_summary_change, WorkoutLog: workout_summary_change}
+
+def apply_food_to_summary(food_log, sign=1):
+    add_to_daily_summaries(FoodLog, food_log.user_id, [food_summary_change(food_log, sign)])
+
+def apply_workout_to_summary(workout, sign=1):
+    add_to_daily_summaries(WorkoutLog, workout.user_id, [workout_summary_change(workout, sign)])
+
+def as_date(value):
+    # func.date() comes back as a string on sqlite and as a date on postgres
+    return value if isinstance(value, date) else date.fromisoformat(str(value))
+
+def rebuild_daily_summaries(user_id=None):
+    summaries = {}
+    def summary_for(row_user_id, day):
+        key = (row_user_id, as_date(day))
+        if key not in summaries:
+            summaries[key] = new_daily_summary(*key)
+        return summaries[key]
+
+    food_day = db.func.date(FoodLog.log_date)
+    food_query = db.session.query(FoodLog.user_id, food_day, db.func.sum(FoodLog.calories), db.func.sum(FoodLog.protein),
+                                  db.func.sum(FoodLog.carbs), db.func.sum(FoodLog.fats), db.func.count(FoodLog.id)
+                                  ).filter(FoodLog.log_date.isnot(None), FoodLog.deleted_at.is_(None)
+                                  ).group_by(FoodLog.user_id, food_day)
+    workout_day = db.func.date(WorkoutLog.log_date)
+    workout_query = db.session.query(WorkoutLog.user_id, workout_day, WorkoutLog.intensity, db.func.sum(WorkoutLog.duration),
+                                     db.func.count(WorkoutLog.id)
+                                     ).filter(WorkoutLog.log_date.isnot(None), WorkoutLog.deleted_at.is_(None)
+                                     ).group_by(WorkoutLog.user_id, workout_day, WorkoutLog.intensity)
+    delete_query = DailySummary.query
+    if user_id is not None:
+        food_query = food_query.filter(FoodLog.user_id == user_id)
+        workout_query = workout_query.filter(WorkoutLog.user_id == user_id)
+        delete_query = delete_query.filter_by(user_id=user_id)
+
+    for row_user_id, day, calories, protein, carbs, fats, entries in food_query:
+        summary = summary_for(row_user_id, day)
+        summary.calories, summary.protein, summary.carbs, summary.fats = calories, protein, carbs, fats
+        summary.food_entries = entries
+    for row_user_id, day, intensity, minutes, entries in workout_query:
+        summary = summary_for(row_user_id, day)
+        summary.workout_minutes += minutes
+        summary.workout_entries += entries
+        if intensity in INTENSITY_MINUTES:
+            setattr(summary, INTENSITY_MINUTES[intensity], minutes)
+
+    archives = LogArchive.query
+    if user_id is not None:
+        archives = archives.filter_by(user_id=user_id)
+    for block in archives:  # data is deferred, only the summaries are read here
+        for day, totals in json.loads(block.summary)['days'].items():
+            summary = summary_for(block.user_id, date.fromisoformat(day))
+            for column, value in totals.items():
+                setattr(summary, column, getattr(summary, column) + value)
+
+    delete_query.delete(synchronize_session=False)
+    db.session.add_all(summaries.values())
+    bump_cache_version('summaries', 0 if user_id is None else user_id)  # 0 is part of every user's key
+    db.session.commit()
+    return len(summaries)
+
+@bp.cli.command('rebuild-summaries')
+@click.option('--user-id', type=int, default=None, help='Only rebuild this user (default: everyone)')
+@schema_required
+def rebuild_summaries_command(user_id):
+    # backfill after imports or if the summaries ever drift from the raw logs
+    count = rebuild_daily_summaries(user_id)
+    click.echo(f'Rebuilt {count} daily summaries.')
+
+
+def upgrade_schema():
+    # create_all() skips tables that already exist, so columns and indexes added later have to be created separately
+    inspector = db.inspect(db.engine)
+    added = set()
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                preparer = db.engine.dialect.identifier_preparer
+                column_type = column.type.compile(db.engine.dialect)
+                default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ''
+                with db.engine.begin() as connection:
+                    connection.execute(db.text(f'ALTER TABLE {preparer.format_table(table)} '
+                                               f'ADD COLUMN {preparer.format_column(column)} {column_type}{default}'))
+                added.add(table.name)
+        if table.name == 'job' and 'uq_job_dedupe_queued' not in {index['name'] for index in inspector.get_indexes('job')}:
+            supersede_duplicate_jobs()  # a queue from before the unique index can hold the same work twice
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    if 'daily_summary' in added:
+        rebuild_daily_summaries()  # new summary columns start at zero, fill them from the logs
+    for block in LogArchive.query.filter(LogArchive.summary.notlike('%"max_version"%')):
+        block.summary = archive_summary(block.log_type, block.rows())  # blocks written before the bounds were kept
+    db.session.commit()
+
+class HashingBusy(Exception):
+    pass
+
+class PasswordHasher: #runs bcrypt on a bounded pool so a burst of logins can't take every worker thread
+    def __init__(self):
+        self.executor = None
+        self.slots = None
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.hashed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def start(self):
+        with self.lock:
+            if self.executor is None:
+                # bcrypt releases the GIL, so a thread pool is enough to use every core
+                self.executor = ThreadPoolExecutor(max_workers=current_app.config['HASH_POOL_WORKERS'], thread_name_prefix='bcrypt')
+                self.slots = threading.BoundedSemaphore(current_app.config['HASH_QUEUE_SIZE'])
+
+    def run(self, func, *args):
+        self.start()
+        if not self.slots.acquire(timeout=current_app.config['HASH_QUEUE_TIMEOUT']):
+            with self.lock:
+                self.rejected += 1
+            raise HashingBusy()
+        with self.lock:
+            self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            return self.executor.submit(func, *args).result()
+        finally:
+            elapsed = time.perf_counter() - started
+            self.slots.release()
+            with self.lock:
+                self.in_flight -= 1
+                self.hashed += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+
+    def hash(self, password):
+        return self.run(bcrypt.generate_password_hash, password, current_app.config['BCRYPT_LOG_ROUNDS']).decode('utf-8')
+
+    def check(self, pw_hash, password):
+        return self.run(bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        try:
+            return int(pw_hash.split('$')[2]) != current_app.config['BCRYPT_LOG_ROUNDS']  # $2b$<rounds>$<salt+hash>
+        except (IndexError, ValueError):
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                'queue_depth': self.in_flight,
+                'hashed': self.hashed,
+                'rejected': self.rejected,
+                'avg_seconds': self.total_seconds / self.hashed if self.hashed else 0.0,
+                'max_seconds': self.max_seconds,
+                'log_rounds': current_app.config['BCRYPT_LOG_ROUNDS'],
+            }
+
+password_hasher = PasswordHasher()
+
+def hashing_busy(error):
+    return 'The server is busy, please try again in a moment.', 503, {'Retry-After': '1'}
+
+def hashing_gauges():
+    stats = password_hasher.stats()
+    return [
+        ('kickstart_hash_queue_depth', 'Password hashes running or waiting.', 'gauge', stats['queue_depth']),
+        ('kickstart_hash_total', 'Password hashes and checks completed.', 'counter', stats['hashed']),
+        ('kickstart_hash_rejected_total', 'Logins turned away because the hash queue was full.', 'counter', stats['rejected']),
+        ('kickstart_hash_seconds_avg', 'Average hash latency including queueing.', 'gauge', stats['avg_seconds']),
+        ('kickstart_hash_seconds_max', 'Slowest hash so far.', 'gauge', stats['max_seconds']),
+    ]
+
+metrics.collectors.append(hashing_gauges)
+
+# throttling for login, register and api token requests. every attempt costs a bcrypt run and a user lookup,
+# so the limits are checked first and a rejected attempt costs one store round trip and nothing else
+DEFAULT_CONFIG['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+DEFAULT_CONFIG['RATE_LIMIT_PER_IP'] = (30, 60)        # (burst, seconds to refill it) for login attempts from one address
+DEFAULT_CONFIG['RATE_LIMIT_PER_USERNAME'] = (10, 60)  # same, per username whatever address it comes from
+DEFAULT_CONFIG['RATE_LIMIT_REGISTER_PER_IP'] = (5, 600)
+DEFAULT_CONFIG['LOCKOUT_FAILURES'] = 10               # failed logins for one username within LOCKOUT_WINDOW locks it
+DEFAULT_CONFIG['LOCKOUT_WINDOW'] = 15 * 60
+DEFAULT_CONFIG['RATE_LIMIT_STORE_PATH'] = os.environ.get('RATE_LIMIT_STORE_PATH')  # sqlite file shared by every worker on the host
+DEFAULT_CONFIG['RATE_LIMIT_BACKEND'] = None           # anything with take/add_failure/failures/clear_failures, e.g. a redis wrapper
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+class MemoryRateLimitStore: #token buckets and failure windows for a single process
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.buckets = OrderedDict()   # key -> (tokens, time of last refill)
+        self.failure_times = OrderedDict()  # key -> deque of failure times, oldest first
+        self.lock = threading.Lock()
+
+    def evict(self, entries):
+        while len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+    def take(self, key, capacity, period, now):
+        # returns (allowed, seconds until the next token)
+        rate = capacity / period
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            self.evict(self.buckets)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+    def add_failure(self, key, window, now):
+        with self.lock:
+            times = self.failure_times.pop(key, None) or deque()
+            times.append(now)
+            while times[0] <= now - window:
+                times.popleft()
+            self.failure_times[key] = times
+            self.evict(self.failure_times)
+
+    def failures(self, key, since):
+        with self.lock:
+            return [at for at in self.failure_times.get(key, ()) if at > since]
+
+    def clear_failures(self, key):
+        with self.lock:
+            self.failure_times.pop(key, None)
+
+class SqliteRateLimitStore: #same interface on a sqlite file, so pre-forked workers on one host share their counts
+    # a local stand-in for a shared store like redis, each operation is one short BEGIN IMMEDIATE transaction
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.calls = 0
+        connection = self.connect()
+        connection.execute('CREATE TABLE IF NOT EXISTS rate_bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+        connection.execute('CREATE TABLE IF NOT EXISTS rate_failure (key TEXT NOT NULL, at REAL NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS ix_rate_failure_key_at ON rate_failure (key, at)')
+
+    def connect(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def transaction(self, func, *args):
+        connection = self.connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = func(connection, *args)
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return result
+
+    def take(self, key, capacity, period, now):
+        rate = capacity / period
+        def take_token(connection):
+            row = connection.execute('SELECT tokens, updated FROM rate_bucket WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            connection.execute('INSERT OR REPLACE INTO rate_bucket (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens, now))
+            self.calls += 1
+            if self.calls % 1000 == 0:
+                # a bucket idle for a day is full again, dropping it changes nothing
+                connection.execute('DELETE FROM rate_bucket WHERE updated < ?', (now - 86400,))
+            return allowed, 0.0 if allowed else (1 - tokens) / rate
+        return self.transaction(take_token)
+
+    def add_failure(self, key, window, now):
+        def insert(connection):
+            connection.execute('INSERT INTO rate_failure (key, at) VALUES (?, ?)', (key, now))
+            connection.execute('DELETE FROM rate_failure WHERE key = ? AND at <= ?', (key, now - window))
+        self.transaction(insert)
+
+    def failures(self, key, since):
+        rows = self.connect().execute('SELECT at FROM rate_failure WHERE key = ? AND at > ? ORDER BY at', (key, since))
+        return [at for at, in rows]
+
+    def clear_failures(self, key):
+        self.connect().execute('DELETE FROM rate_failure WHERE key = ?', (key,))
+
+rate_limit_rejections = Counter()  # limit name -> attempts turned away
+rate_limit_lock = threading.Lock()
+
+def get_rate_limit_store():
+    if current_app.config['RATE_LIMIT_BACKEND'] is not None:
+        return current_app.config['RATE_LIMIT_BACKEND']
+    state = app_state()
+    with rate_limit_lock:
+        if state.rate_limit_store is None:
+            path = current_app.config['RATE_LIMIT_STORE_PATH']
+            state.rate_limit_store = SqliteRateLimitStore(path) if path else MemoryRateLimitStore()
+    return state.rate_limit_store
+
+def reject(name, retry_after):
+    with rate_limit_lock:
+        rate_limit_rejections[name] += 1
+    raise RateLimited(retry_after)
+
+def take_token(name, key, limit):
+    capacity, period = limit
+    allowed, retry_after = get_rate_limit_store().take(f'{name}:{key}', capacity, period, time.time())
+    if not allowed:
+        reject(name, retry_after)
+
+def limit_key(username):
+    return (username or '').strip().lower()
+
+def check_login_allowed(username):
+    # called before the form is validated, so nothing here touches the database or bcrypt
+    if not current_app.config['RATE_LIMIT_ENABLED']:
+        return
+    take_token('login_ip', request.remote_addr, current_app.config['RATE_LIMIT_PER_IP'])
+    now = time.time()
+    window, max_failures = current_app.config['LOCKOUT_WINDOW'], current_app.config['LOCKOUT_FAILURES']
+    failures = get_rate_limit_store().failures('lockout:' + limit_key(username), now - window)
+    if len(failures) >= max_failures:
+        # locked until enough of the failures slide out of the window
+        reject('lockout', failures[len(failures) - max_failures] + window - now)
+    take_token('login_username', limit_key(username), current_app.config['RATE_LIMIT_PER_USERNAME'])
+
+def check_register_allowed():
+    if current_app.config['RATE_LIMIT_ENABLED']:
+        take_token('register_ip', request.remote_addr, current_app.config['RATE_LIMIT_REGISTER_PER_IP'])
+
+def record_login_failure(username):
+    if current_app.config['RATE_LIMIT_ENABLED']:
+        get_rate_limit_store().add_failure('lockout:' + limit_key(username), current_app.config['LOCKOUT_WINDOW'], time.time())
+
+def clear_login_failures(username):
+    if current_app.config['RATE_LIMIT_ENABLED']:
+        get_rate_limit_store().clear_failures('lockout:' + limit_key(username))
+
+def rate_limited(error):
+    headers = {'Retry-After': str(max(1, math.ceil(error.retry_after)))}
+    if request.path.startswith('/api/'):
+        return jsonify({'error': 'too many attempts, try again later'}), 429, headers
+    return 'Too many attempts, please try again later.', 429, headers
+
+def rate_limit_counters():
+    with rate_limit_lock:
+        return [(f'kickstart_rate_limited_{name}_total', f'Attempts rejected by the {name} limit.', 'counter', count)
+                for name, count in sorted(rate_limit_rejections.items())]
+
+metrics.collectors.append(rate_limit_counters)
+
+def finite_number(form, field):
+    # FloatField takes 'nan' and 'inf' like float() does
+    if field.data is not None and not math.isfinite(field.data):
+        raise ValidationError('Must be a finite number.')
 
 class RegisterForm(FlaskForm):
     username = StringField(validators=[InputRequired(), Length(
@@ -80,35 +847,53 @@ class LoginForm(FlaskForm):
     submit = SubmitField("Login")
 
 class BmiForm(FlaskForm):
-    weight = FloatField('Weight (in kg)', validators=[DataRequired()])
-    height = FloatField('Height (in cm)', validators=[DataRequired()])
+    weight = FloatField('Weight (in kg)', validators=[DataRequired(), finite_number])
+    height = FloatField('Height (in cm)', validators=[DataRequired(), finite_number])
     submit = SubmitField('Calculate BMI')
 
 class TdeeForm(FlaskForm):
     gender = SelectField('Gender', choices=[('male', 'Male'), ('female', 'Female')], validators=[DataRequired()])
-    weight = FloatField('Weight (in kg)', validators=[DataRequired()])
-    height = FloatField('Height (in cm)', validators=[DataRequired()])
-    age = FloatField('Age (in years)', validators=[DataRequired()])
+    weight = FloatField('Weight (in kg)', validators=[DataRequired(), finite_number])
+    height = FloatField('Height (in cm)', validators=[DataRequired(), finite_number])
+    age = FloatField('Age (in years)', validators=[DataRequired(), finite_number])
     activity_level = SelectField('Activity Level', choices=[('sedentary', 'Sedentary'), ('lightly_active', 'Lightly Active'), ('moderately_active', 'Moderately Active'), ('very_active', 'Very Active')], validators=[DataRequired()])
     submit = SubmitField('Calculate TDEE')
 
 class FoodLogForm(FlaskForm):
-    food_name = StringField('Food Name', validators=[DataRequired()])
-    quantity = FloatField('Quantity (in grams)', validators=[DataRequired()])
-    calories = FloatField('Calories', validators=[DataRequired()])
-    protein = FloatField('Protein (in grams)', validators=[DataRequired()])
-    carbs = FloatField('Carbs (in grams)', validators=[DataRequired()])
-    fats = FloatField('Fats (in grams)', validators=[DataRequired()])
+    food_item_id = HiddenField()  # set by the typeahead, the macros are then filled in from the catalog
+    food_name = StringField('Food Name', validators=[DataRequired()], render_kw={"autocomplete": "off"})
+    quantity = FloatField('Quantity (in grams)', validators=[DataRequired(), finite_number])
+    calories = FloatField('Calories', validators=[Optional(), finite_number])
+    protein = FloatField('Protein (in grams)', validators=[Optional(), finite_number])
+    carbs = FloatField('Carbs (in grams)', validators=[Optional(), finite_number])
+    fats = FloatField('Fats (in grams)', validators=[Optional(), finite_number])
     log_date = DateTimeField('Log Date', format='%Y-%m-%d %H:%M:%S', validators=[DataRequired()])
     submit = SubmitField('Log Food')
 
+    def validate(self, extra_validators=None):
+        if not super().validate(extra_validators):
+            return False
+        macro_fields = (self.calories, self.protein, self.carbs, self.fats)
+        if self.food_item_id.data:
+            item = get_food_item(int(self.food_item_id.data), current_user.id) if self.food_item_id.data.isdigit() else None
+            if item is None:
+                self.food_name.errors.append('That food is no longer in the catalog.')
+                return False
+            for field, value in scale_food_item(item, self.quantity.data).items():
+                getattr(self, field).data = value
+            return True
+        missing = [field for field in macro_fields if field.data is None]
+        for field in missing:
+            field.errors.append('This field is required.')
+        return not missing
+
 class WorkoutLogForm(FlaskForm):
     exercise_name = StringField('Exercise Name', validators=[DataRequired()], render_kw={"placeholder": "E.g., Running"})
     intensity = SelectField('Intensity Level',
                             choices=[('Low', 'Low'), ('Medium', 'Medium'), ('High', 'High')],
                             validators=[DataRequired()],
                             render_kw={"placeholder": "Select Intensity"})
-    duration = FloatField('Duration (in minutes)', validators=[DataRequired()], render_kw={"placeholder": "Duration in minutes"})
+    duration = FloatField('Duration (in minutes)', validators=[DataRequired(), finite_number], render_kw={"placeholder": "Duration in minutes"})
     # using datetime here to store dates
     log_date = DateTimeLocalField('Log Date and Time',
                                   format='%Y-%m-%dT%H:%M',
@@ -134,8 +919,8 @@ class WorkoutDaysForm(FlaskForm):
 
 class WorkoutPlanForm(FlaskForm):
     age = IntegerField('Age', validators=[DataRequired(), NumberRange(min=18, max=100)])
-    current_weight = FloatField('Current Weight (kg)', validators=[DataRequired(), NumberRange(min=30)])
-    goal_weight = FloatField('Goal Weight (kg)', validators=[DataRequired(), NumberRange(min=30)])
+    current_weight = FloatField('Current Weight (kg)', validators=[DataRequired(), NumberRange(min=30), finite_number])
+    goal_weight = FloatField('Goal Weight (kg)', validators=[DataRequired(), NumberRange(min=30), finite_number])
     training_preference = RadioField('Training Preference', choices=[
         ('weight', 'Weight Intensive'),
         ('cardio', 'Cardio Intensive'),
@@ -143,48 +928,65 @@ class WorkoutPlanForm(FlaskForm):
     ], validators=[DataRequired()])
     submit = SubmitField('Get your results')
 
-@app.route('/')
+@bp.route('/')
 def home():
     return render_template('home.html')
 
-@app.route('/login', methods= ['GET', 'POST'])
+@bp.route('/login', methods= ['GET', 'POST'])
 def login():
     form = LoginForm()
+    if request.method == 'POST':
+        check_login_allowed(request.form.get('username'))
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        if user and password_hasher.check(user.password, form.password.data):
+            if password_hasher.needs_rehash(user.password):
+                user.password = password_hasher.hash(form.password.data)
+                db.session.commit()
+            clear_login_failures(form.username.data)
             login_user(user)
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('kickstart.dashboard'))
         else:
+            record_login_failure(form.username.data)
             flash('Invalid username or password', 'danger')
     return render_template('login.html', form=form)
 
-@app.route('/dashboard', methods=['GET', 'POST'])
+DASHBOARD_RECENT_ENTRIES = 5
+
+def recent_logs(model, user_id, limit=DASHBOARD_RECENT_ENTRIES):
+    return (model.query.filter(model.user_id == user_id, model.deleted_at.is_(None))
+            .order_by(model.log_date.desc(), model.id.desc()).limit(limit).all())
+
+@bp.route('/dashboard', methods=['GET', 'POST'])
 @login_required
 def dashboard():
-    food_logs = FoodLog.query.filter_by(user_id=current_user.id).all()
-    workout_logs = WorkoutLog.query.filter_by(user_id=current_user.id).all()
-    return render_template('dashboard.html', food_logs=food_logs, workout_logs=workout_logs)
+    # fixed cost per request: one summary row plus two small index scans, bmi/tdee are already on current_user
+    today = DailySummary.query.filter_by(user_id=current_user.id, day=date.today()).first()
+    recent_food_logs = recent_logs(FoodLog, current_user.id)
+    recent_workouts = recent_logs(WorkoutLog, current_user.id)
+    return render_template('dashboard.html', today=today, recent_food_logs=recent_food_logs, recent_workouts=recent_workouts)
 
 
-@app.route('/logout', methods=['GET', 'POST'])
+@bp.route('/logout', methods=['GET', 'POST'])
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('kickstart.login'))
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     form = RegisterForm()
+    if request.method == 'POST':
+        check_register_allowed()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        hashed_password = password_hasher.hash(form.password.data)
         new_user = User(username=form.username.data, password=hashed_password)
         db.session.add(new_user)
         db.session.commit()
-        return redirect(url_for('login'))
+        return redirect(url_for('kickstart.login'))
     return render_template('register.html', form=form)
 
-@app.route('/bmi_calculator', methods=['GET', 'POST'])  #route function for BMI
+@bp.route('/bmi_calculator', methods=['GET', 'POST'])  #route function for BMI
 @login_required
 def bmi_calculator():
     form = BmiForm()
@@ -200,7 +1002,7 @@ def bmi_calculator():
         
     return render_template('bmi_calculator.html', title='BMI', form=form, bmi_result=bmi_result)
 
-@app.route('/tdee_calculator', methods=['GET', 'POST'])
+@bp.route('/tdee_calculator', methods=['GET', 'POST'])
 @login_required
 def tdee_calculator():
     form = TdeeForm()
@@ -220,7 +1022,7 @@ def tdee_calculator():
 
 
 # Route for viewing food log
-@app.route('/food_log', methods=['GET', 'POST'])
+@bp.route('/food_log', methods=['GET', 'POST'])
 @login_required
 def food_log():
     form = FoodLogForm()
@@ -236,37 +1038,108 @@ def food_log():
             log_date=form.log_date.data
         )
         db.session.add(new_food_log)
+        apply_food_to_summary(new_food_log)
+        remember_food(new_food_log)
         db.session.commit()
         
-        return redirect(url_for('dashboard'))         #removed flash messages as they were showing up in login page
+        return redirect(url_for('kickstart.dashboard'))         #removed flash messages as they were showing up in login page
     return render_template('food_log.html', form=form)
 
 
-# route for deleting food log entry
-@app.route('/food_log_history')
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+def encode_cursor(log, date_column='log_date'):
+    return f"{getattr(log, date_column).isoformat()}_{log.id}"
+
+MAX_CURSOR_INT = 2 ** 63 - 1  # the largest integer sqlite (or a postgres bigint) takes as a parameter
+
+def cursor_int(value):
+    number = int(value)
+    if not 0 <= number <= MAX_CURSOR_INT:
+        raise ValueError('cursor value out of range')
+    return number
+
+def decode_cursor(cursor):
+    try:
+        log_date, log_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(log_date), cursor_int(log_id)
+    except ValueError:
+        abort(400)
+
+def parse_date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        abort(400)
+
+def paginate_logs(model, user_id, date_column='log_date'):
+    # keyset pagination on (log_date, id) - every page is one index range scan, no matter how old the cursor is
+    per_page = min(max(request.args.get('per_page', HISTORY_PAGE_SIZE, type=int) or HISTORY_PAGE_SIZE, 1), HISTORY_MAX_PAGE_SIZE)
+    start = parse_date_arg('start')
+    end = parse_date_arg('end')
+    column = getattr(model, date_column)
+    query = model.query.filter(model.user_id == user_id)
+    if model in SYNCED_MODELS:
+        query = query.filter(model.deleted_at.is_(None))
+    if start:
+        query = query.filter(column >= start)
+    if end:
+        query = query.filter(column < end + timedelta(days=1))  # end date is inclusive
+    cursor = request.args.get('cursor')
+    if cursor:
+        log_date, log_id = decode_cursor(cursor)
+        query = query.filter(db.or_(column < log_date,
+                                    db.and_(column == log_date, model.id < log_id)))
+    logs = query.order_by(column.desc(), model.id.desc()).limit(per_page + 1).all()
+    horizon = archive_horizon(model, user_id) if model in SYNCED_MODELS else None
+    if horizon is not None and (len(logs) <= per_page or logs[-1].log_date <= horizon):
+        # when the hot rows fill the page, only archive blocks reaching back past its oldest row can interleave
+        not_older_than = logs[-1].log_date if len(logs) > per_page else None
+        archived = archived_logs(model, user_id, start, end + timedelta(days=1) if end else None,
+                                 decode_cursor(cursor) if cursor else None, not_older_than)
+        logs = sorted(logs + list(islice(archived, per_page + 1)), key=lambda log: (log.log_date, log.id), reverse=True)
+        logs = logs[:per_page + 1]
+    next_cursor = None
+    if len(logs) > per_page:
+        logs = logs[:per_page]
+        next_cursor = encode_cursor(logs[-1], date_column)
+    filters = {'start': request.args.get('start', ''), 'end': request.args.get('end', ''), 'per_page': per_page}
+    return logs, next_cursor, filters
+
+# route for viewing food log history
+@bp.route('/food_log_history')
 @login_required
 def food_log_history():
-    food_logs = FoodLog.query.filter_by(user_id=current_user.id).order_by(FoodLog.log_date.desc()).all()
-    return render_template('food_log_history.html', food_logs=food_logs)
+    food_logs, next_cursor, filters = paginate_logs(FoodLog, current_user.id)
+    return render_template('food_log_history.html', food_logs=food_logs, next_cursor=next_cursor, filters=filters)
 
 # editing food log
-@app.route('/edit_food_log/<int:food_log_id>', methods=['GET', 'POST'])
+@bp.route('/edit_food_log/<int:food_log_id>', methods=['GET', 'POST'])
 @login_required
 def edit_food_log(food_log_id):
     food_log = FoodLog.query.get_or_404(food_log_id)
     if food_log.user_id != current_user.id:
         abort(403)
+    if food_log.deleted_at is not None:
+        abort(404)
     form = FoodLogForm()
     if form.validate_on_submit():
+        apply_food_to_summary(food_log, -1)
         food_log.food_name = form.food_name.data
         food_log.quantity = form.quantity.data
         food_log.calories = form.calories.data
         food_log.protein = form.protein.data
         food_log.carbs = form.carbs.data
         food_log.fats = form.fats.data
+        apply_food_to_summary(food_log)
+        remember_food(food_log)
         db.session.commit()
         flash('Your food log has been updated!', 'success')
-        return redirect(url_for('food_log_history'))
+        return redirect(url_for('kickstart.food_log_history'))
     elif request.method == 'GET':
         form.food_name.data = food_log.food_name
         form.quantity.data = food_log.quantity
@@ -276,18 +1149,20 @@ def edit_food_log(food_log_id):
         form.fats.data = food_log.fats
     return render_template('edit_food_log.html', title='Edit Food Log', form=form)
 
-@app.route('/delete_food_log/<int:food_log_id>', methods=['POST'])  #route for deleting workout entry (working)
+@bp.route('/delete_food_log/<int:food_log_id>', methods=['POST'])  #route for deleting workout entry (working)
 @login_required
 def delete_food_log(food_log_id):
     food_log = FoodLog.query.get_or_404(food_log_id)
     if food_log.user_id != current_user.id:
         abort(403)
-    db.session.delete(food_log)
+    if food_log.deleted_at is None:
+        apply_food_to_summary(food_log, -1)
+        food_log.deleted_at = datetime.utcnow()
     db.session.commit()   
-    return redirect(url_for('food_log_history'))
+    return redirect(url_for('kickstart.food_log_history'))
 
 # route for viewing workout log
-@app.route('/workout_log', methods=['GET', 'POST'])
+@bp.route('/workout_log', methods=['GET', 'POST'])
 @login_required
 def workout_log():
     form = WorkoutLogForm()
@@ -298,72 +1173,912 @@ def workout_log():
                                  duration=form.duration.data,
                                  log_date=form.log_date.data)
         db.session.add(new_workout)
+        apply_workout_to_summary(new_workout)
         db.session.commit()        
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('kickstart.dashboard'))
     return render_template('workout_log.html', form=form)
 
 
 # Route for deleting workout log entry
-@app.route('/delete_workout/<int:workout_id>', methods=['POST'])
+@bp.route('/delete_workout/<int:workout_id>', methods=['POST'])
 @login_required
 def delete_workout(workout_id):
     workout = WorkoutLog.query.get_or_404(workout_id)
     if workout.user_id != current_user.id:
         abort(403)  # Forbidden access if the current user does not own the workout log   
-    db.session.delete(workout)
+    if workout.deleted_at is None:
+        apply_workout_to_summary(workout, -1)
+        workout.deleted_at = datetime.utcnow()
     db.session.commit()   
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('kickstart.dashboard'))
 
-@app.route('/edit_workout_log/<int:workout_id>', methods=['GET', 'POST'])
+@bp.route('/edit_workout_log/<int:workout_id>', methods=['GET', 'POST'])
 @login_required
 def edit_workout_log(workout_id):
     workout = WorkoutLog.query.get_or_404(workout_id)
     
     if workout.user_id != current_user.id:
         abort(403)  #access not allowed if user is not recognized
+    if workout.deleted_at is not None:
+        abort(404)
 
     form = WorkoutLogForm(obj=workout)
     if form.validate_on_submit():
+        apply_workout_to_summary(workout, -1)
         workout.exercise_name = form.exercise_name.data
         workout.intensity = form.intensity.data
         workout.duration = form.duration.data
         workout.log_date = form.log_date.data
+        apply_workout_to_summary(workout)
         db.session.commit()       
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('kickstart.dashboard'))
     return render_template('edit_workout_log.html', form=form, workout_id=workout_id)
 
-@app.route('/workout_log_history')
+@bp.route('/workout_log_history')
 @login_required
 def workout_log_history():
-    user_id = current_user.id
-    workouts = WorkoutLog.query.filter_by(user_id=user_id).order_by(WorkoutLog.log_date.desc()).all()
-    return render_template('workout_log_history.html', workouts=workouts)
+    workouts, next_cursor, filters = paginate_logs(WorkoutLog, current_user.id)
+    return render_template('workout_log_history.html', workouts=workouts, next_cursor=next_cursor, filters=filters)
+
+# bulk import / export - lets people bring years of history over from other trackers in one request
+IMPORT_BATCH_SIZE = 1000
+IMPORT_SPOOL_SIZE = 8 * 1024 * 1024
+EXPORT_BATCH_SIZE = 1000
+INTENSITY_LEVELS = ('Low', 'Medium', 'High')
+
+def parse_text(value, max_length=100):
+    value = (value or '').strip()
+    if not value or len(value) > max_length:
+        raise ValueError('must be between 1 and %d characters' % max_length)
+    return value
+
+def parse_number(value):
+    number = float(value)
+    if not math.isfinite(number):  # float() takes 'nan' and 'inf', sqlite would store nan as NULL
+        raise ValueError('must be a finite number')
+    if number < 0:
+        raise ValueError('must not be negative')
+    return number
+
+def parse_intensity(value):
+    if value not in INTENSITY_LEVELS:
+        raise ValueError('must be one of ' + ', '.join(INTENSITY_LEVELS))
+    return value
+
+def parse_log_date(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).strip())
+
+LOG_TYPES = {
+    'food_log': (FoodLog, {'food_name': parse_text, 'quantity': parse_number, 'calories': parse_number,
+                           'protein': parse_number, 'carbs': parse_number, 'fats': parse_number,
+                           'log_date': parse_log_date}),
+    'workout_log': (WorkoutLog, {'exercise_name': parse_text, 'intensity': parse_intensity,
+                                 'duration': parse_number, 'log_date': parse_log_date}),
+}
+
+def get_log_type(log_type):
+    if log_type not in LOG_TYPES:
+        abort(404)
+    return LOG_TYPES[log_type]
+
+def request_format():
+    requested = request.args.get('format')
+    if requested:
+        return requested
+    upload = request.files.get('file')
+    if upload and upload.filename.endswith('.ndjson'):
+        return 'ndjson'
+    if upload is None and request.mimetype in ('application/x-ndjson', 'application/json'):
+        return 'ndjson'
+    return 'csv'
+
+IMPORT_BODY_MIMETYPES = ('text/csv', 'application/x-ndjson', 'application/json')
+
+def check_import_origin():
+    # the import is authenticated by the session cookie. a cross-site form can post urlencoded, multipart and
+    # text/plain bodies without a cors preflight, so a raw body has to be one of the types only our own pages can
+    # send, and a multipart upload needs the csrf token like every other form
+    if request.mimetype == 'multipart/form-data':
+        if current_app.config.get('WTF_CSRF_ENABLED', True):
+            try:
+                validate_csrf(request.form.get('csrf_token') or request.headers.get('X-CSRFToken'))
+            except ValidationError as error:
+                return jsonify({'error': str(error)}), 400
+    elif request.mimetype not in IMPORT_BODY_MIMETYPES:
+        return jsonify({'error': 'Content-Type must be one of ' + ', '.join(IMPORT_BODY_MIMETYPES) + ' or a multipart upload'}), 415
+    return None
+
+def stage_import_body():
+    # the upload is read in full before the import opens its write transaction, otherwise the database write lock
+    # would be held for as long as a slow client takes to send the body. multipart files are already spooled by
+    # werkzeug, a raw body is copied to a temporary file that only goes to disk once it's over IMPORT_SPOOL_SIZE
+    upload = request.files.get('file')
+    if upload is not None:
+        return upload.stream
+    staged = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE)
+    shutil.copyfileobj(request.stream, staged)
+    staged.seek(0)
+    return staged
+
+def read_import_rows(fmt, body):
+    # reads the staged body row by row, so a large upload is never held in memory as one string
+    stream = io.TextIOWrapper(body, encoding='utf-8-sig')
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'ndjson':
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                yield line_number, json.loads(line)
+    else:
+        abort(400)
+
+def convert_row(fields, row, user_id):
+    values = {'user_id': user_id}
+    for field, parse in fields.items():
+        try:
+            values[field] = parse(row.get(field))
+        except (TypeError, ValueError) as error:
+            raise ValueError(f'{field}: {error}')
+    return values
+
+@bp.route('/import/<log_type>', methods=['POST'])
+@login_required
+def import_logs(log_type):
+    model, fields = get_log_type(log_type)
+    rejected = check_import_origin()
+    if rejected:
+        return rejected
+    fmt = request_format()
+    body = stage_import_body()
+    insert = db.insert(model)
+    batch = []
+    imported = 0
+    # executemany skips the ORM flush hooks, so the whole import shares one sync version stamped here
+    sync = {'version': allocate_sync_version(db.session.connection(), current_user.id), 'updated_at': datetime.utcnow()}
+    try:
+        for line_number, row in read_import_rows(fmt, body):
+            try:
+                batch.append({**convert_row(fields, row, current_user.id), **sync})
+            except (AttributeError, ValueError) as error:
+                db.session.rollback()
+                return jsonify({'error': str(error), 'line': line_number}), 400
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                db.session.execute(insert, batch)  # one executemany per batch instead of one statement per row
+                imported += len(batch)
+                batch = []
+        if batch:
+            db.session.execute(insert, batch)
+            imported += len(batch)
+    except (UnicodeDecodeError, csv.Error, json.JSONDecodeError) as error:
+        db.session.rollback()
+        return jsonify({'error': str(error)}), 400
+    db.session.commit()
+    # the summary rebuild is O(history), so it goes on the job queue. that only takes it off the request with
+    # JOBS_ASYNC=1 and a run-worker process, otherwise enqueue_job runs it right here (see background jobs)
+    job = enqueue_job('rebuild_summaries', user_id=current_user.id, dedupe_key=f'rebuild_summaries:{current_user.id}')
+    return jsonify({'imported': imported, 'summary_job': job.to_dict()})
+
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+def export_chunks(model, fields, user_id, fmt):
+    columns = ['id'] + list(fields)
+    # yield_per keeps a server side cursor open, so memory stays flat however long the history is. rows
+    # without a date sort first on every database, the same as they do in the merge below
+    query = (model.query.filter(model.user_id == user_id, model.deleted_at.is_(None))
+             .order_by(model.log_date.asc().nulls_first(), model.id).yield_per(EXPORT_BATCH_SIZE))
+    # both streams are in (log_date, id) order, so merging them keeps the whole export in that order. a month
+    # archived by date can still hold rows older than hot ones, e.g. entries backdated after the archive ran
+    query = heapq.merge(archived_logs(model, user_id, newest_first=False), query,
+                        key=lambda log: (log.log_date or datetime.min, log.id))
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for log in query:
+            writer.writerow([getattr(log, column) for column in columns])
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for log in query:
+            row = {column: getattr(log, column) for column in columns}
+            row['log_date'] = row['log_date'].isoformat() if row['log_date'] else None
+            yield json.dumps(row) + '\n'
+
+@bp.route('/export/<log_type>')
+@login_required
+def export_logs(log_type):
+    model, fields = get_log_type(log_type)
+    fmt = request_format()
+    if fmt not in EXPORT_MIMETYPES:
+        abort(400)
+    response = Response(stream_with_context(export_chunks(model, fields, current_user.id, fmt)), mimetype=EXPORT_MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={log_type}.{fmt}'
+    return response
+
+# cold history. rows older than ARCHIVE_AFTER_DAYS are moved out of food_log/workout_log into one compressed
+# columnar block per user, log type and month, so the hot tables and their indexes only hold recent data.
+# archived rows are read only, history pages and exports merge them back in, and the day by day totals
+# stay in each block's summary so rebuild_daily_summaries doesn't lose them
+DEFAULT_CONFIG['ARCHIVE_AFTER_DAYS'] = 365
+ARCHIVE_DELETE_CHUNK = 500
+
+def archive_horizon(model, user_id):
+    # newest archived log_date, so most pages skip the archive. not cached, archive-logs runs in another
+    # process and the lookup only touches the user's block headers (one per month), never their data
+    return db.session.query(db.func.max(LogArchive.last_date)).filter_by(user_id=user_id, log_type=model.__tablename__).scalar()
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+def next_month(value):
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+def archive_columns(model):
+    return ['id'] + list(LOG_TYPES[model.__tablename__][1]) + ['version', 'updated_at']
+
+def encode_archive_rows(columns, logs):
+    # column oriented json compresses far better than row oriented, repeated food names and dates mostly vanish
+    data = {}
+    for column in columns:
+        values = [getattr(log, column) for log in logs]
+        data[column] = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'), 9)
+
+def decode_archive_rows(blob):
+    data = json.loads(zlib.decompress(blob))
+    for column in ('log_date', 'updated_at'):
+        data[column] = [datetime.fromisoformat(value) if value else None for value in data[column]]
+    columns = list(data)
+    return [SimpleNamespace(archived=True, deleted_at=None, **dict(zip(columns, values))) for values in zip(*data.values())]
+
+def archive_day_totals(log_type, logs):
+    # the same per day numbers rebuild_daily_summaries gets from the hot tables
+    days = {}
+    for log in logs:
+        day = days.setdefault(log.log_date.date().isoformat(), {})
+        if log_type == 'food_log':
+            for field in ('calories', 'protein', 'carbs', 'fats'):
+                day[field] = day.get(field, 0) + getattr(log, field)
+            day['food_entries'] = day.get('food_entries', 0) + 1
+        else:
+            day['workout_minutes'] = day.get('workout_minutes', 0) + log.duration
+            day['workout_entries'] = day.get('workout_entries', 0) + 1
+            if log.intensity in INTENSITY_MINUTES:
+                column = INTENSITY_MINUTES[log.intensity]
+                day[column] = day.get(column, 0) + log.duration
+    return days
+
+def archive_summary(log_type, rows):
+    # the id and version bounds let by-id lookups and sync skip blocks without decompressing them
+    return json.dumps({'days': archive_day_totals(log_type, rows), 'ids': [min(row.id for row in rows), max(row.id for row in rows)],
+                       'max_version': max(row.version for row in rows)})
+
+def archive_month(model, user_id, month):
+    # moves one user's month into its block (merging with the block if an earlier run already wrote one)
+    log_type = model.__tablename__
+    logs = (model.query.filter(model.user_id == user_id, model.deleted_at.is_(None),
+                               model.log_date >= month, model.log_date < next_month(month))
+            .order_by(model.log_date, model.id).all())
+    if not logs:
+        return 0
+    block = LogArchive.query.filter_by(user_id=user_id, log_type=log_type, month=month.date()).first()
+    rows = logs
+    if block is None:
+        block = LogArchive(user_id=user_id, log_type=log_type, month=month.date())
+        db.session.add(block)
+    else:
+        rows = sorted(block.rows() + logs, key=lambda row: (row.log_date, row.id))
+    block.data = encode_archive_rows(archive_columns(model), rows)
+    block.row_count = len(rows)
+    block.first_date, block.last_date = rows[0].log_date, rows[-1].log_date
+    block.summary = archive_summary(log_type, rows)
+    block.updated_at = datetime.utcnow()
+    ids = [log.id for log in logs]
+    for chunk_start in range(0, len(ids), ARCHIVE_DELETE_CHUNK):
+        model.query.filter(model.id.in_(ids[chunk_start:chunk_start + ARCHIVE_DELETE_CHUNK])).delete(synchronize_session=False)
+    db.session.commit()
+    return len(logs)
+
+def archive_logs(days=None, user_id=None):
+    # only whole months before the horizon move, one transaction per block so a crash loses nothing.
+    # the daily summaries are left alone, archived rows still count towards them
+    days = current_app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    cutoff = month_start(datetime.utcnow() - timedelta(days=days))
+    archived = 0
+    for model, fields in LOG_TYPES.values():
+        stale = db.session.query(model.user_id).filter(model.log_date < cutoff, model.deleted_at.is_(None))
+        if user_id is not None:
+            stale = stale.filter(model.user_id == user_id)
+        for (row_user_id,) in stale.distinct().all():
+            while True:
+                oldest = (db.session.query(db.func.min(model.log_date))
+                          .filter(model.user_id == row_user_id, model.log_date < cutoff, model.deleted_at.is_(None)).scalar())
+                if oldest is None:
+                    break
+                archived += archive_month(model, row_user_id, month_start(oldest))
+    return archived
+
+def archived_logs(model, user_id, start=None, end=None, before=None, not_older_than=None, newest_first=True):
+    # yields archived rows in (log_date, id) order. blocks are only read (and decompressed) when the
+    # iteration reaches them, so a caller that stops early never touches the older months
+    query = LogArchive.query.filter_by(user_id=user_id, log_type=model.__tablename__)
+    if start:
+        query = query.filter(LogArchive.last_date >= start)
+    if end:
+        query = query.filter(LogArchive.first_date < end)
+    if before:
+        query = query.filter(LogArchive.first_date <= before[0])
+    if not_older_than:
+        query = query.filter(LogArchive.last_date >= not_older_than)
+    order = LogArchive.month.desc() if newest_first else LogArchive.month
+    for block in query.order_by(order).all():
+        rows = block.rows()
+        for row in reversed(rows) if newest_first else rows:
+            if (start and row.log_date < start) or (end and row.log_date >= end):
+                continue
+            if before and (row.log_date, row.id) >= before:
+                continue
+            yield row
+
+def archive_blocks(model, user_id):
+    return LogArchive.query.filter_by(user_id=user_id, log_type=model.__tablename__).order_by(LogArchive.month.desc())
+
+def find_archived_logs(model, user_id, ids):
+    # id -> archived row for the ids that were archived, the newest blocks are tried first
+    wanted = set(ids)
+    found = {}
+    for block in archive_blocks(model, user_id):
+        id_range = json.loads(block.summary).get('ids')
+        if id_range and not any(id_range[0] <= log_id <= id_range[1] for log_id in wanted - found.keys()):
+            continue
+        found.update((row.id, row) for row in block.rows() if row.id in wanted)
+        if len(found) == len(wanted):
+            break
+    return found
+
+def archived_sync_logs(model, user_id, version, log_id, limit):
+    # archived rows after the (version, id) position, for the sync download. archiving doesn't change a row's
+    # version, so a client that synced before the move already has them and its cursor skips every block
+    rows = []
+    for block in archive_blocks(model, user_id):
+        max_version = json.loads(block.summary).get('max_version')
+        if max_version is not None and max_version < version:
+            continue
+        rows.extend(row for row in block.rows() if (row.version, row.id) > (version, log_id))
+    return sorted(rows, key=lambda row: (row.version, row.id))[:limit]
+
+@bp.cli.command('archive-logs')
+@click.option('--days', type=int, default=None, help='archive whole months older than this (default: ARCHIVE_AFTER_DAYS)')
+@click.option('--user-id', type=int, default=None, help='Only archive this user (default: everyone)')
+@schema_required
+def archive_logs_command(days, user_id):
+    click.echo(f'Archived {archive_logs(days, user_id)} log entries.')
+
+# food catalog - typeahead search over bundled foods plus the user's own past entries
+FOOD_CATALOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'foods.csv')
+FOOD_SEARCH_LIMIT = 10
+APP_CACHES['food_search'] = {'maxsize': 5000, 'ttl': 300}  # keyed on the 'food_catalog' cache versions, see bump_food_catalog
+
+def food_terms(name):
+    return set(re.findall(r'[a-z0-9]+', name.lower()))
+
+def add_food_items(items):
+    db.session.add_all(items)
+    db.session.flush()  # one flush for all of them, the terms need their ids
+    db.session.add_all(FoodItemTerm(term=term[:100], food_item_id=item.id) for item in items for term in food_terms(item.name))
+
+def add_food_item(item):
+    add_food_items([item])
+
+def delete_food_items(query):
+    item_ids = query.with_entities(FoodItem.id)
+    FoodItemTerm.query.filter(FoodItemTerm.food_item_id.in_(item_ids.scalar_subquery())).delete(synchronize_session=False)
+    query.delete(synchronize_session=False)
+
+def bump_food_catalog(user_id=0):
+    # 0 is the bundled set, which is part of every user's search
+    bump_cache_version('food_catalog', user_id)
+
+def load_bundled_foods(path=FOOD_CATALOG_FILE):
+    delete_food_items(FoodItem.query.filter_by(source='bundled'))
+    with open(path, newline='', encoding='utf-8') as catalog_file:
+        rows = list(csv.DictReader(catalog_file))
+    for row in rows:
+        add_food_item(FoodItem(name=row['name'], calories=float(row['calories']), protein=float(row['protein']),
+                               carbs=float(row['carbs']), fats=float(row['fats']), source='bundled'))
+    bump_food_catalog()
+    db.session.commit()
+    return len(rows)
+
+def load_user_foods():
+    # every distinct food a user has logged becomes a catalog entry, averaged per 100g over all their entries.
+    # archived months count too, they are still food the user ate, just no longer in food_log
+    delete_food_items(FoodItem.query.filter_by(source='user'))
+    total_quantity = db.func.sum(FoodLog.quantity)
+    rows = db.session.query(FoodLog.user_id, FoodLog.food_name, total_quantity, db.func.sum(FoodLog.calories),
+                            db.func.sum(FoodLog.protein), db.func.sum(FoodLog.carbs), db.func.sum(FoodLog.fats)
+                            ).filter(FoodLog.quantity > 0, FoodLog.deleted_at.is_(None)
+                            ).group_by(FoodLog.user_id, FoodLog.food_name).all()
+    totals = {(user_id, name): list(sums) for user_id, name, *sums in rows}
+    for block in LogArchive.query.filter_by(log_type='food_log').order_by(LogArchive.id).all():
+        for row in block.rows():  # one block decompressed at a time
+            if row.quantity > 0:
+                sums = totals.setdefault((block.user_id, row.food_name), [0, 0, 0, 0, 0])
+                for index, value in enumerate((row.quantity, row.calories, row.protein, row.carbs, row.fats)):
+                    sums[index] += value
+    add_food_items([FoodItem(user_id=user_id, name=name, calories=calories * 100 / quantity, protein=protein * 100 / quantity,
+                             carbs=carbs * 100 / quantity, fats=fats * 100 / quantity, source='user')
+                    for (user_id, name), (quantity, calories, protein, carbs, fats) in totals.items()])
+    bump_food_catalog()  # every user's entries were rebuilt, the shared version is in all their keys
+    db.session.commit()
+    return len(totals)
+
+def remember_foods(user_id, food_logs):
+    # keeps the user's catalog entries in step with what they last logged, so they autofill next time.
+    # one query finds the entries for every name in the batch, the last log of each name wins
+    latest = {food_log.food_name: food_log for food_log in food_logs if food_log.quantity and food_log.quantity > 0}
+    if not latest:
+        return
+    items = {item.name: item for item in FoodItem.query.filter(FoodItem.user_id == user_id, FoodItem.name.in_(latest))}
+    new_items = []
+    for name, food_log in latest.items():
+        per_100g = {field: getattr(food_log, field) * 100 / food_log.quantity for field in ('calories', 'protein', 'carbs', 'fats')}
+        if name in items:
+            for field, value in per_100g.items():
+                setattr(items[name], field, value)
+        else:
+            new_items.append(FoodItem(user_id=user_id, name=name, source='user', **per_100g))
+    if new_items:
+        add_food_items(new_items)
+    bump_food_catalog(user_id)
+
+def remember_food(food_log):
+    remember_foods(food_log.user_id, [food_log])
+
+def scale_food_item(item, quantity):
+    return {field: round(getattr(item, field) * quantity / 100, 1) for field in ('calories', 'protein', 'carbs', 'fats')}
+
+def get_food_item(food_item_id, user_id):
+    item = db.session.get(FoodItem, food_item_id)
+    if item is None or item.user_id not in (None, user_id):
+        return None
+    return item
+
+def search_foods(user_id, text, limit=FOOD_SEARCH_LIMIT):
+    terms = sorted(food_terms(text))
+    if not terms:
+        return []
+    key = (user_id, get_cache_versions('food_catalog', 0, user_id), ' '.join(terms), limit)
+    cached = app_cache('food_search').get(key)
+    if cached is not None:
+        return cached
+    query = FoodItem.query.filter(db.or_(FoodItem.user_id.is_(None), FoodItem.user_id == user_id))
+    for term in terms:
+        # a range on the term index is a prefix match that works the same on sqlite and postgres
+        matching = db.select(FoodItemTerm.food_item_id).where(FoodItemTerm.term >= term, FoodItemTerm.term < term + '\uffff')
+        query = query.filter(FoodItem.id.in_(matching))
+    own_first = db.case((FoodItem.user_id.is_(None), 1), else_=0)
+    items = query.order_by(own_first, db.func.length(FoodItem.name), FoodItem.name).limit(limit).all()
+    results = [item.to_dict() for item in items]
+    app_cache('food_search').set(key, results)
+    return results
+
+@bp.cli.command('load-food-catalog')
+@click.option('--path', default=FOOD_CATALOG_FILE, help='CSV of name,calories,protein,carbs,fats per 100g')
+@schema_required
+def load_food_catalog_command(path):
+    click.echo(f'Loaded {load_bundled_foods(path)} bundled foods.')
+    click.echo(f'Loaded {load_user_foods()} foods from users\' past entries.')
+
+@bp.route('/api/foods')
+@login_required
+def food_typeahead():
+    results = search_foods(current_user.id, request.args.get('q', ''))
+    response = jsonify(results)
+    response.cache_control.private = True
+    response.cache_control.max_age = 60
+    return response
+
+@bp.route('/api/foods/<int:food_item_id>/log', methods=['POST'])
+@login_required
+def quick_food_log(food_item_id):
+    # one small request per entry: pick a catalog food and a quantity, the macros are worked out here
+    item = get_food_item(food_item_id, current_user.id)
+    if item is None:
+        abort(404)
+    data = request.get_json(silent=True) or {}
+    try:
+        quantity = parse_number(data.get('quantity'))
+        log_date = parse_log_date(data['log_date']) if data.get('log_date') else datetime.now()
+    except (TypeError, ValueError) as error:
+        return jsonify({'error': str(error)}), 400
+    new_food_log = FoodLog(user_id=current_user.id, food_name=item.name, quantity=quantity, log_date=log_date,
+                           **scale_food_item(item, quantity))
+    db.session.add(new_food_log)
+    apply_food_to_summary(new_food_log)
+    db.session.commit()
+    return jsonify({'id': new_food_log.id, 'food_name': new_food_log.food_name, 'quantity': quantity,
+                    'calories': new_food_log.calories, 'protein': new_food_log.protein, 'carbs': new_food_log.carbs,
+                    'fats': new_food_log.fats, 'log_date': new_food_log.log_date.isoformat()}), 201
+
+# analytics - rolling intake vs tdee and weekly training load, computed from the daily summaries
+ANALYTICS_WINDOWS = (7, 30, 90)
+ANALYTICS_DEFAULT_DAYS = 90
+ANALYTICS_MAX_DAYS = 365
+APP_CACHES['analytics'] = {'maxsize': 2000, 'ttl': 600}  # keyed on the 'summaries' cache versions
+
+def rolling_mean(values, counts, window):
+    # mean over the logged days in each trailing window, days with nothing logged don't drag the average to zero
+    value_sums = np.cumsum(values, axis=0)
+    count_sums = np.cumsum(counts)
+    value_sums[window:] = value_sums[window:] - value_sums[:-window]
+    count_sums[window:] = count_sums[window:] - count_sums[:-window]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return value_sums / count_sums[:, None], count_sums
+
+def build_analytics(user_id, tdee, end, days):
+    # read enough history before the window for the longest rolling average
+    lookback = max(ANALYTICS_WINDOWS) - 1
+    start = end - timedelta(days=days + lookback - 1)
+    rows = DailySummary.query.filter(DailySummary.user_id == user_id, DailySummary.day >= start,
+                                     DailySummary.day <= end).all()
+    span = (end - start).days + 1
+    macros = np.zeros((span, 4))
+    logged = np.zeros(span)
+    minutes = np.zeros((span, 3))
+    for row in rows:
+        index = (row.day - start).days
+        macros[index] = (row.calories, row.protein, row.carbs, row.fats)
+        logged[index] = 1 if row.food_entries > 0 else 0
+        minutes[index] = (row.low_minutes, row.medium_minutes, row.high_minutes)
+
+    averages = {window: rolling_mean(macros, logged, window)[0] for window in ANALYTICS_WINDOWS}
+    balance = macros[:, 0] - tdee if tdee else np.full(span, np.nan)
+
+    def rounded(values):
+        return [None if np.isnan(value) else round(float(value), 1) for value in values]
+
+    daily = []
+    for index in range(lookback, span):
+        entry = {
+            'date': (start + timedelta(days=index)).isoformat(),
+            'logged': bool(logged[index]),
+            'calories': round(float(macros[index, 0]), 1),
+            'protein': round(float(macros[index, 1]), 1),
+            'carbs': round(float(macros[index, 2]), 1),
+            'fats': round(float(macros[index, 3]), 1),
+            'balance': round(float(balance[index]), 1) if logged[index] and tdee else None,  # + surplus, - deficit
+        }
+        for window, values in averages.items():
+            entry[f'avg_{window}d'] = dict(zip(('calories', 'protein', 'carbs', 'fats'), rounded(values[index])))
+        daily.append(entry)
+
+    # weekly training minutes by intensity, weeks start on monday
+    window_start = start + timedelta(days=lookback)
+    week_index = (np.arange(days) + window_start.weekday()) // 7
+    weekly_minutes = np.zeros((week_index[-1] + 1, 3))
+    np.add.at(weekly_minutes, week_index, minutes[lookback:])
+    first_monday = window_start - timedelta(days=window_start.weekday())
+    weekly = [{'week_start': (first_monday + timedelta(weeks=week)).isoformat(),
+               'Low': round(float(low), 1), 'Medium': round(float(medium), 1), 'High': round(float(high), 1),
+               'total': round(float(low + medium + high), 1)}
+              for week, (low, medium, high) in enumerate(weekly_minutes)]
+    return {'tdee': tdee, 'start': window_start.isoformat(), 'end': end.isoformat(), 'daily': daily, 'weekly_training': weekly}
+
+@bp.route('/api/analytics')
+@login_required
+def analytics():
+    days = min(max(request.args.get('days', ANALYTICS_DEFAULT_DAYS, type=int) or ANALYTICS_DEFAULT_DAYS, 1), ANALYTICS_MAX_DAYS)
+    end = parse_date_arg('end') or datetime.combine(date.today(), datetime.min.time())
+    key = (current_user.id, get_cache_versions('summaries', 0, current_user.id), current_user.tdee, end.date(), days)
+    result = app_cache('analytics').get(key)
+    if result is None:
+        result = build_analytics(current_user.id, current_user.tdee, end.date(), days)
+        app_cache('analytics').set(key, result)
+    return jsonify(result)
+
+# background jobs - requests enqueue slow per-user work and return straight away, workers pick it up.
+# that takes JOBS_ASYNC=1 in the environment of the web server *and* at least one `flask --app app run-worker`
+# process. with JOBS_ASYNC off (the default, handy for the dev server) nothing ever reads the queue, so
+# enqueue_job runs the job inside the request before returning, e.g. /import rebuilds the summaries inline
+DEFAULT_CONFIG['JOBS_ASYNC'] = os.environ.get('JOBS_ASYNC') == '1'
+DEFAULT_CONFIG['JOB_RETRY_DELAY'] = 5         # seconds, doubled after every failed attempt
+DEFAULT_CONFIG['JOB_LEASE_SECONDS'] = 600     # running jobs older than this are assumed to belong to a dead worker
+DEFAULT_CONFIG['JOB_POLL_INTERVAL'] = 1.0
+DEFAULT_CONFIG['JOB_REQUEUE_INTERVAL'] = 60   # seconds between sweeps for jobs left running by a dead worker
+JOB_HANDLERS = {}
+USER_JOB_KINDS = ('rebuild_summaries', 'export', 'assessment')
+
+def job_handler(kind):
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+def enqueue_job(kind, payload=None, user_id=None, dedupe_key=None, max_attempts=3):
+    if dedupe_key:
+        # the same work is already waiting, hand back that job instead of queueing it twice. a running job
+        # may have read its input before the change that triggered this request, so that one doesn't count
+        existing = Job.query.filter_by(dedupe_key=dedupe_key, status='queued').first()
+        if existing is not None:
+            return existing
+    job = Job(kind=kind, user_id=user_id, payload=json.dumps(payload or {}), dedupe_key=dedupe_key,
+              max_attempts=max_attempts, status='queued', attempts=0)
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # another request queued the same work between the lookup and the insert and uq_job_dedupe_queued
+        # turned this one away, look again (or insert again if a worker has claimed that job meanwhile)
+        db.session.rollback()
+        return enqueue_job(kind, payload, user_id, dedupe_key, max_attempts)
+    if not current_app.config['JOBS_ASYNC']:
+        # no worker will ever look at the queue, so retries run straight away instead of waiting for run_after
+        while job.status == 'queued' and claim_job(job.id, 'inline'):
+            job = execute_job(job)
+    return job
+
+def claim_job(job_id, worker_id):
+    # the status check in the WHERE makes the claim atomic, a second worker gets rowcount 0
+    now = datetime.utcnow()
+    claimed = Job.query.filter_by(id=job_id, status='queued').update(
+        {'status': 'running', 'locked_by': worker_id, 'attempts': Job.attempts + 1, 'updated_at': now},
+        synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+def claim_next_job(worker_id):
+    while True:
+        job_id = db.session.query(Job.id).filter(Job.status == 'queued', Job.run_after <= datetime.utcnow()
+                                                 ).order_by(Job.run_after, Job.id).limit(1).scalar()
+        if job_id is None:
+            return None
+        if claim_job(job_id, worker_id):
+            return db.session.get(Job, job_id)
+
+def execute_job(job):
+    job_id = job.id
+    db.session.refresh(job)
+    try:
+        result = JOB_HANDLERS[job.kind](job)
+    except Exception as error:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.error = f'{type(error).__name__}: {error}'
+        if job.attempts < job.max_attempts:
+            requeue_job(job, datetime.utcnow() + timedelta(seconds=current_app.config['JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1)))
+        else:
+            job.status = 'failed'
+        current_app.logger.exception('job %s (%s) failed on attempt %s', job.id, job.kind, job.attempts)
+    else:
+        job = db.session.get(Job, job_id)
+        job.status = 'done'
+        job.result = json.dumps(result)
+        job.error = None
+    job.locked_by = None
+    job.updated_at = datetime.utcnow()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # the same work was queued between requeue_job's check and this commit, that job will do it
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.status = 'failed'
+        job.error = 'superseded by a job queued for the same work'
+        job.locked_by = None
+        db.session.commit()
+    return job
+
+def requeue_job(job, run_after=None):
+    # back to queued for another attempt, unless the same work has been queued again since: only one queued
+    # job per dedupe key is allowed (uq_job_dedupe_queued) and that one will do it. returns whether it requeued
+    duplicate = None
+    if job.dedupe_key:
+        duplicate = db.session.query(Job.id).filter(Job.dedupe_key == job.dedupe_key, Job.status == 'queued',
+                                                    Job.id != job.id).limit(1).scalar()
+    job.locked_by = None
+    if duplicate is not None:
+        job.status = 'failed'
+        job.error = '; '.join(filter(None, [job.error, f'superseded by job {duplicate}, queued for the same work']))
+        return False
+    job.status = 'queued'
+    if run_after is not None:
+        job.run_after = run_after
+    return True
+
+def supersede_duplicate_jobs():
+    # keeps the oldest queued job of every dedupe key, the later ones would have done the same work again
+    oldest = (db.session.query(db.func.min(Job.id)).filter(Job.status == 'queued', Job.dedupe_key.isnot(None))
+              .group_by(Job.dedupe_key).scalar_subquery())
+    Job.query.filter(Job.status == 'queued', Job.dedupe_key.isnot(None), Job.id.notin_(oldest)).update(
+        {'status': 'failed', 'error': 'superseded by an older job queued for the same work'}, synchronize_session=False)
+    db.session.commit()
+
+def requeue_stale_jobs():
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_LEASE_SECONDS'])
+    stale = Job.query.filter(Job.status == 'running', Job.updated_at < cutoff).order_by(Job.id).all()
+    count = sum(requeue_job(job) for job in stale)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return requeue_stale_jobs()  # the same work was queued meanwhile, requeue_job sees it this time
+    return count
 
-@app.route('/select_workout_preference', methods=['GET', 'POST'])
+def run_worker(worker_id, stop_after_idle=False, app=None):
+    app = app or create_app()  # a worker process builds its own app from the environment, like the cli did
+    with app.app_context():
+        db.engine.dispose(close=False)  # never share connections inherited from the parent process
+        last_requeue = time.monotonic()
+        while True:
+            if time.monotonic() - last_requeue >= current_app.config['JOB_REQUEUE_INTERVAL']:
+                # workers that die mid job leave it running, sweep for them while the pool is up too
+                requeue_stale_jobs()
+                last_requeue = time.monotonic()
+            job = claim_next_job(worker_id)
+            if job is None:
+                if stop_after_idle:
+                    return
+                time.sleep(current_app.config['JOB_POLL_INTERVAL'])
+                continue
+            execute_job(job)
+            db.session.remove()
+
+def export_file_path(job):
+    payload = json.loads(job.payload)
+    return os.path.join(current_app.instance_path, 'exports', f'job-{job.id}.{payload["format"]}')
+
+@job_handler('rebuild_summaries')
+def rebuild_summaries_job(job):
+    return {'summaries': rebuild_daily_summaries(job.user_id)}
+
+@job_handler('export')
+def export_job(job):
+    payload = json.loads(job.payload)
+    model, fields = LOG_TYPES[payload['log_type']]
+    path = export_file_path(job)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rows = 0
+    with open(path, 'w', encoding='utf-8', newline='') as export_file:
+        for chunk in export_chunks(model, fields, job.user_id, payload['format']):
+            export_file.write(chunk)
+            rows += chunk.count('\n')
+    return {'file': os.path.basename(path), 'lines': rows}
+
+@job_handler('archive_logs')
+def archive_logs_job(job):
+    payload = json.loads(job.payload)
+    return {'archived': archive_logs(payload.get('days'), job.user_id)}
+
+@job_handler('assessment')
+def assessment_job(job):
+    payload = json.loads(job.payload)
+    return {'results': batch_generate_workout_plans(payload['age'], payload['current_weight'], payload['goal_weight'],
+                                                    payload['training_preference'], payload['tdee'])}
+
+def validate_job_payload(kind, payload):
+    if kind == 'export':
+        if payload.get('log_type') not in LOG_TYPES or payload.get('format', 'csv') not in EXPORT_MIMETYPES:
+            raise ValueError('export needs log_type (food_log or workout_log) and format (csv or ndjson)')
+        return {'log_type': payload['log_type'], 'format': payload.get('format', 'csv')}
+    if kind == 'assessment':
+        columns = assessment_columns(payload)
+        for index, row in enumerate(zip(*columns)):
+            try:
+                check_assessment_row(*row)
+            except (TypeError, ValueError) as error:
+                raise ValueError(f'client {index}: {error}') from error
+        return dict(zip(ASSESSMENT_FIELDS, columns))
+    return {}
+
+def get_user_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None or job.user_id != current_user.id:
+        abort(404)
+    return job
+
+@bp.route('/api/jobs', methods=['POST'])
+@login_required
+def create_job():
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    if kind not in USER_JOB_KINDS:
+        return jsonify({'error': 'kind must be one of ' + ', '.join(USER_JOB_KINDS)}), 400
+    try:
+        payload = validate_job_payload(kind, data.get('payload') or {})
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+    dedupe_key = f'{kind}:{current_user.id}:' + hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    job = enqueue_job(kind, payload, user_id=current_user.id, dedupe_key=dedupe_key)
+    return jsonify(job.to_dict()), 202, {'Location': url_for('kickstart.job_status', job_id=job.id)}
+
+@bp.route('/api/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    return jsonify(get_user_job(job_id).to_dict())
+
+@bp.route('/api/jobs/<int:job_id>/download')
+@login_required
+def download_job_export(job_id):
+    job = get_user_job(job_id)
+    if job.kind != 'export' or job.status != 'done':
+        abort(404)
+    payload = json.loads(job.payload)
+    return send_file(export_file_path(job), mimetype=EXPORT_MIMETYPES[payload['format']], as_attachment=True,
+                     download_name=f'{payload["log_type"]}.{payload["format"]}')
+
+@bp.cli.command('run-worker')
+@click.option('--processes', type=int, default=os.cpu_count() or 2, help='worker processes to start')
+@click.option('--once', is_flag=True, help='work through the queue and exit instead of polling forever')
+@schema_required
+def run_worker_command(processes, once):
+    requeued = requeue_stale_jobs()
+    if requeued:
+        click.echo(f'Requeued {requeued} jobs left running by a dead worker.')
+    db.engine.dispose()
+    if processes <= 1:
+        run_worker(f'{socket.gethostname()}:{os.getpid()}', stop_after_idle=once, app=current_app._get_current_object())
+        return
+    workers = [multiprocessing.Process(target=run_worker, args=(f'{socket.gethostname()}:worker-{number}', once))
+               for number in range(processes)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+
+@bp.route('/select_workout_preference', methods=['GET', 'POST'])
 @login_required
 def select_workout_preference():
     form = WorkoutPreferenceForm()
     if form.validate_on_submit():
         session['preference'] = form.preference.data
-        return redirect(url_for('select_workout_days'))
+        return redirect(url_for('kickstart.select_workout_days'))
     return render_template('select_workout_preference.html', form=form)
 
-@app.route('/select_workout_days', methods=['GET', 'POST'])
+@bp.route('/select_workout_days', methods=['GET', 'POST'])
 @login_required
 def select_workout_days():
     form = WorkoutDaysForm()
     if form.validate_on_submit():
         session['days'] = form.days.data
-        return redirect(url_for('display_workout_plan'))
+        return redirect(url_for('kickstart.display_workout_plan'))
     return render_template('select_workout_days.html', form=form)
 
-@app.route('/display_workout_plan')
+plan_page_cache = {}
+
+def rendered_workout_plan(key):
+    # the plans never change between deploys, so each one is rendered once and reused for every user
+    cached = plan_page_cache.get(key)
+    if cached is None or current_app.debug:
+        body = render_template('workout_split.html', plan=WORKOUT_PLANS[key])
+        etag = hashlib.sha1(body.encode('utf-8')).hexdigest()
+        cached = plan_page_cache[key] = (body, etag, datetime.utcnow().replace(microsecond=0))
+    return cached
+
+@bp.route('/display_workout_plan')
 @login_required
 def display_workout_plan():
-    preference = session.get('preference')
-    days = session.get('days')
-    plan_template_name = f"{preference}_{days}_day_split.html"
-    return render_template(plan_template_name)
+    key = (session.get('preference'), session.get('days'))
+    if key not in WORKOUT_PLANS:
+        return redirect(url_for('kickstart.select_workout_preference'))
+    body, etag, last_modified = rendered_workout_plan(key)
+    response = Response(body, mimetype='text/html')
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True  # browsers revalidate and get a 304 while the plan is unchanged
+    return response.make_conditional(request)
 
 def calculate_intensity(age, training_preference):
     base_intensity = max(10 - (age - 20) / 5, 1)  #base intensity is 10 and reduces slightly every 5 years the user is older 20 yrs
@@ -424,39 +2139,39 @@ def adjust_workout_volume(user, base_volume):
     else:
         return base_volume * 0.9
 
-def calculate_nutritional_goals(user):
-    # Constants for macronutrient caloric values in nutrional sceince
-    CALORIES_PER_GRAM_PROTEIN = 4
-    CALORIES_PER_GRAM_CARBS = 4
-    CALORIES_PER_GRAM_FAT = 9
+# Constants for macronutrient caloric values in nutrional sceince
+CALORIES_PER_GRAM_PROTEIN = 4
+CALORIES_PER_GRAM_CARBS = 4
+CALORIES_PER_GRAM_FAT = 9
+
+# (protein, fat, carb) share of daily calories for each training preference
+MACRO_RATIOS = {
+    'weight': (0.30, 0.25, 0.45),  # i made a higher protein ratio for higher protein intake
+    'cardio': (0.25, 0.20, 0.55),  # Higher carbs for energy
+    'hybrid': (0.25, 0.30, 0.45),  # this is for Hybrid or balanced training
+}
+
+def caloric_goal_statement(current_weight, goal_weight, daily_calories):
+    if goal_weight < current_weight:
+        return f"To lose weight, aim for a daily caloric intake of about {daily_calories:.0f} calories."
+    elif goal_weight > current_weight:
+        return f"To gain weight, aim for a daily caloric intake of about {daily_calories:.0f} calories."
+    return f"To maintain your current weight, aim for a daily caloric intake of about {daily_calories:.0f} calories."
 
+def calculate_nutritional_goals(user):
     # base calorie intake
     if user.goal_weight < user.current_weight:
         # calorie defecit
         daily_calories = user.tdee - 250 #chose the value 250 as its the safest number preventing any adverse effects in the human body
-        caloric_goal_statement = f"To lose weight, aim for a daily caloric intake of about {daily_calories:.0f} calories."
     elif user.goal_weight > user.current_weight:
         # calorie surplus
         daily_calories = user.tdee + 250
-        caloric_goal_statement = f"To gain weight, aim for a daily caloric intake of about {daily_calories:.0f} calories."
     else:
         # Maintenance
         daily_calories = user.tdee
-        caloric_goal_statement = f"To maintain your current weight, aim for a daily caloric intake of about {daily_calories:.0f} calories."
-        
+
     # Macronutrional goals for the user based on their inputs
-    if user.training_preference == 'weight':
-        protein_ratio = 0.30  # i made a higher protein ratio for higher protein intake
-        fat_ratio = 0.25
-        carb_ratio = 0.45
-    elif user.training_preference == 'cardio':
-        protein_ratio = 0.25
-        fat_ratio = 0.20
-        carb_ratio = 0.55  # Higher carbs for energy 
-    else:  # this is for Hybrid or balanced training
-        protein_ratio = 0.25
-        fat_ratio = 0.30
-        carb_ratio = 0.45
+    protein_ratio, fat_ratio, carb_ratio = MACRO_RATIOS.get(user.training_preference, MACRO_RATIOS['hybrid'])
 
     # calculate macronutrient intake for the user (in grams)
     protein_grams = (daily_calories * protein_ratio) / CALORIES_PER_GRAM_PROTEIN
@@ -468,16 +2183,10 @@ def calculate_nutritional_goals(user):
         'protein_grams': round(protein_grams, 1),
         'fat_grams': round(fat_grams, 1),
         'carb_grams': round(carb_grams, 1),
-        'caloric_goal_statement': caloric_goal_statement  
+        'caloric_goal_statement': caloric_goal_statement(user.current_weight, user.goal_weight, daily_calories)
     }
 
-def generate_workout_plan(user):
-    intensity = calculate_intensity(user.age, user.training_preference)
-    base_volume = calculate_volume(user.current_weight, user.goal_weight, user.training_preference, user.age)
-    adjusted_volume = adjust_workout_volume(user, base_volume)
-    sessions_per_week = workout_sessions_per_week(user.age, user.training_preference)
-    nutrition = calculate_nutritional_goals(user)
-
+def describe_workout_plan(intensity, adjusted_volume, sessions_per_week, training_preference, nutrition):
     # simple description for intensity, this is based on the intensity fucntion above
     if intensity < 4:
         intensity_description = 'Light intensity. consider increasing intensity over time.'
@@ -486,37 +2195,211 @@ def generate_workout_plan(user):
     else:
         intensity_description = 'High intensity. Push yourself close to your limits (failure), ensuring proper form.'
 
-    
     volume_description = f'Your weekly exercise volume is recommended to be {adjusted_volume:.1f} sets. Distribute this evenly over your sessions.'
 
-    
-
     # Compile the assessment details - just returns all the results for the user in the form of statements
     return {
         'intensity_description': intensity_description,
         'volume_description': volume_description,
         'sessions_per_week': f'{sessions_per_week} sessions per week.',
-        'focus': f'Focus on {user.training_preference.title()} intensive training.',
+        'focus': f'Focus on {training_preference.title()} intensive training.',
         'nutrition': nutrition,
-        
     }
-    
 
-@app.route('/workout', methods=['GET', 'POST'])
+def generate_workout_plan(user):
+    intensity = calculate_intensity(user.age, user.training_preference)
+    base_volume = calculate_volume(user.current_weight, user.goal_weight, user.training_preference, user.age)
+    adjusted_volume = adjust_workout_volume(user, base_volume)
+    sessions_per_week = workout_sessions_per_week(user.age, user.training_preference)
+    nutrition = calculate_nutritional_goals(user)
+    return describe_workout_plan(intensity, adjusted_volume, sessions_per_week, user.training_preference, nutrition)
+
+# batch version of generate_workout_plan for coaches assessing a whole roster at once.
+# the arithmetic below mirrors the scalar functions step for step (same operations in the same order)
+# so every result is bit for bit what generate_workout_plan gives for the same client
+TRAINING_PREFERENCES = ('weight', 'cardio', 'hybrid')
+ASSESSMENT_BATCH_LIMIT = 10000
+assessment_cache = LRUCache(maxsize=50000, ttl=24 * 3600)
+
+def batch_assessment_arrays(age, current_weight, goal_weight, preference, tdee):
+    is_weight = preference == 'weight'
+    is_cardio = preference == 'cardio'
+    is_hybrid = preference == 'hybrid'
+
+    # calculate_intensity
+    intensity = np.maximum(10 - (age - 20) / 5, 1)
+    intensity = np.where(is_cardio, intensity * 1.1, np.where(is_weight, intensity * 0.9, intensity))
+
+    # calculate_volume
+    volume = np.abs(current_weight - goal_weight) * 5
+    volume = np.where(age < 30, volume * 1.2, volume)
+    volume = np.where(is_hybrid, volume * 1.1, np.where(is_cardio, volume * 0.8, volume))
+    age_factor = np.where(age > 60, 0.5, np.where(age > 50, 0.75, 1.0))
+    volume = np.where(age >= 30, volume * age_factor, volume)
+    volume = np.maximum(np.minimum(volume, 70), 10)
+
+    # adjust_workout_volume
+    volume = np.where(goal_weight > current_weight, volume * 1.1, volume * 0.9)
+
+    # workout_sessions_per_week
+    sessions = np.where(age < 40, 5, 3)
+    sessions = np.where(is_hybrid, np.minimum(sessions + 1, 7), sessions)
+
+    # calculate_nutritional_goals
+    daily_calories = np.where(goal_weight < current_weight, tdee - 250,
+                              np.where(goal_weight > current_weight, tdee + 250, tdee))
+    ratios = np.array([MACRO_RATIOS.get(p, MACRO_RATIOS['hybrid']) for p in preference]).reshape(-1, 3)
+    protein_grams = (daily_calories * ratios[:, 0]) / CALORIES_PER_GRAM_PROTEIN
+    fat_grams = (daily_calories * ratios[:, 1]) / CALORIES_PER_GRAM_FAT
+    carb_grams = (daily_calories * ratios[:, 2]) / CALORIES_PER_GRAM_CARBS
+    return intensity, volume, sessions, daily_calories, protein_grams, fat_grams, carb_grams
+
+def batch_generate_workout_plans(ages, current_weights, goal_weights, preferences, tdees):
+    keys = [(float(a), float(cw), float(gw), p, float(t))
+            for a, cw, gw, p, t in zip(ages, current_weights, goal_weights, preferences, tdees)]
+    results = {}
+    missing = []
+    for key in dict.fromkeys(keys):  # repeated clients are only computed once
+        cached = assessment_cache.get(key)
+        if cached is None:
+            missing.append(key)
+        else:
+            results[key] = cached
+
+    if missing:
+        age, current_weight, goal_weight, preference, tdee = zip(*missing)
+        columns = batch_assessment_arrays(np.array(age), np.array(current_weight), np.array(goal_weight),
+                                          np.array(preference), np.array(tdee))
+        for key, intensity, volume, sessions, daily_calories, protein, fat, carb in zip(missing, *columns):
+            current, goal, training_preference = key[1], key[2], key[3]
+            nutrition = {
+                'daily_calories': float(daily_calories),
+                # python's round() rather than np.round, the two disagree on some halfway cases
+                'protein_grams': round(float(protein), 1),
+                'fat_grams': round(float(fat), 1),
+                'carb_grams': round(float(carb), 1),
+                'caloric_goal_statement': caloric_goal_statement(current, goal, float(daily_calories)),
+            }
+            plan = describe_workout_plan(float(intensity), float(volume), int(sessions), training_preference, nutrition)
+            assessment_cache.set(key, plan)
+            results[key] = plan
+    return [results[key] for key in keys]
+
+ASSESSMENT_FIELDS = ('age', 'current_weight', 'goal_weight', 'training_preference', 'tdee')
+
+def assessment_columns(data):
+    # columnar input: {"age": [...], "current_weight": [...], "goal_weight": [...], "training_preference": [...], "tdee": [...]}
+    if not isinstance(data, dict) or not all(isinstance(data.get(field), list) for field in ASSESSMENT_FIELDS):
+        raise ValueError('expected a list for each of ' + ', '.join(ASSESSMENT_FIELDS))
+    columns = [data[field] for field in ASSESSMENT_FIELDS]
+    if len({len(column) for column in columns}) != 1 or len(columns[0]) > ASSESSMENT_BATCH_LIMIT:
+        raise ValueError(f'all lists must be the same length and at most {ASSESSMENT_BATCH_LIMIT} long')
+    return columns
+
+def check_assessment_row(age, current_weight, goal_weight, training_preference, tdee):
+    # shared by the batch endpoint and the assessment job so both accept exactly the same clients
+    if not all(math.isfinite(float(value)) for value in (age, current_weight, goal_weight, tdee)):
+        raise ValueError('age, weights and tdee must be finite numbers')
+    if not 18 <= float(age) <= 100 or float(current_weight) < 30 or float(goal_weight) < 30:
+        raise ValueError('age must be 18-100 and weights at least 30 kg')
+    if training_preference not in TRAINING_PREFERENCES:
+        raise ValueError('training_preference must be one of ' + ', '.join(TRAINING_PREFERENCES))
+
+@bp.route('/api/assessments/batch', methods=['POST'])
+@login_required
+def batch_assessments():
+    try:
+        columns = assessment_columns(request.get_json(silent=True))
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+    for index, row in enumerate(zip(*columns)):
+        try:
+            check_assessment_row(*row)
+        except (TypeError, ValueError) as error:
+            return jsonify({'error': str(error), 'index': index}), 400
+    return jsonify({'results': batch_generate_workout_plans(*columns)})
+
+
+@bp.route('/workout', methods=['GET', 'POST'])
 @login_required
 def workout():
     form = WorkoutPlanForm()
     if form.validate_on_submit():
-        user = current_user  
-        user.age = form.age.data
-        user.current_weight = form.current_weight.data
-        user.goal_weight = form.goal_weight.data
-        user.training_preference = form.training_preference.data
-
-        workout_plan = generate_workout_plan(user)
-        return render_template('workout_plan.html', plan=workout_plan)
+        if current_user.tdee is None:
+            # the nutrition half of the plan is built on the tdee, so there is nothing to assess without one
+            flash('Calculate your TDEE first, the assessment uses it for your nutritional goals.')
+            return redirect(url_for('kickstart.tdee_calculator'))
+        assessment = get_or_create_assessment(current_user, form.age.data, form.current_weight.data,
+                                              form.goal_weight.data, form.training_preference.data)
+        return render_template('workout_plan.html', plan=assessment.get_plan(), assessment=assessment)
     return render_template('workout_form.html', form=form)
 
+# bump this whenever generate_workout_plan (or anything it calls) changes its output, old snapshots
+# then stop matching new submissions but stay in the history as they were shown at the time
+ASSESSMENT_PLAN_VERSION = 1
+
+def assessment_input_hash(age, current_weight, goal_weight, training_preference, tdee):
+    inputs = [ASSESSMENT_PLAN_VERSION, int(age), float(current_weight), float(goal_weight), training_preference,
+              None if tdee is None else float(tdee)]
+    return hashlib.sha256(json.dumps(inputs).encode('utf-8')).hexdigest()
+
+def get_or_create_assessment(user, age, current_weight, goal_weight, training_preference):
+    # identical inputs are served from the stored snapshot instead of running generate_workout_plan again
+    input_hash = assessment_input_hash(age, current_weight, goal_weight, training_preference, user.tdee)
+    assessment = Assessment.query.filter_by(user_id=user.id, input_hash=input_hash).first()
+    now = datetime.utcnow()
+    if assessment is not None:
+        assessment.submissions += 1
+        assessment.last_submitted_at = now
+        db.session.commit()
+        return assessment
+
+    inputs = SimpleNamespace(age=age, current_weight=current_weight, goal_weight=goal_weight,
+                             training_preference=training_preference, tdee=user.tdee)
+    assessment = Assessment(user_id=user.id, input_hash=input_hash, plan_version=ASSESSMENT_PLAN_VERSION, age=age,
+                            current_weight=current_weight, goal_weight=goal_weight,
+                            training_preference=training_preference, tdee=user.tdee,
+                            plan=json.dumps(generate_workout_plan(inputs)), created_at=now, last_submitted_at=now)
+    db.session.add(assessment)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent identical submission got there first, use its row
+        db.session.rollback()
+        assessment = Assessment.query.filter_by(user_id=user.id, input_hash=input_hash).one()
+    return assessment
+
+def assessment_progress(user_id):
+    # first and latest assessment are both single index lookups on (user_id, created_at, id)
+    first = Assessment.query.filter_by(user_id=user_id).order_by(Assessment.created_at, Assessment.id).first()
+    if first is None:
+        return None
+    latest = Assessment.query.filter_by(user_id=user_id).order_by(Assessment.created_at.desc(), Assessment.id.desc()).first()
+    start, current, goal = first.current_weight, latest.current_weight, latest.goal_weight
+    if start == goal:
+        percent = 100.0 if current == goal else 0.0
+    else:
+        percent = min(max((start - current) / (start - goal) * 100, 0.0), 100.0)
+    return {'start_weight': start, 'current_weight': current, 'goal_weight': goal,
+            'remaining': abs(current - goal), 'percent': round(percent, 1),
+            'since': first.created_at}
+
+@bp.route('/assessments')
+@login_required
+def assessment_history():
+    assessments, next_cursor, filters = paginate_logs(Assessment, current_user.id, date_column='created_at')
+    progress = assessment_progress(current_user.id) if not request.args.get('cursor') else None
+    return render_template('assessment_history.html', assessments=assessments, next_cursor=next_cursor,
+                           filters=filters, progress=progress)
+
+@bp.route('/assessments/<int:assessment_id>')
+@login_required
+def view_assessment(assessment_id):
+    assessment = Assessment.query.get_or_404(assessment_id)
+    if assessment.user_id != current_user.id:
+        abort(403)
+    return render_template('workout_plan.html', plan=assessment.get_plan(), assessment=assessment)
+
 
 def calculate_bmi(height, weight):
     return weight / (height ** 2)
@@ -536,7 +2419,632 @@ def calculate_tdee(gender, height, weight, age, activity_level):  #Mifflin St je
         tdee = bmr * 1.725
     return tdee
 
+# json api for the mobile app, versioned under /api/v1 and authenticated with bearer tokens instead of the
+# session cookie. writes return the stored rows directly, so there is no redirect and no dashboard render after each log
+API_BATCH_LIMIT = 500
+API_TOKEN_TOUCH_INTERVAL = timedelta(minutes=5)  # last_used_at is only written this often, not on every request
+API_RESOURCES = {'food_logs': 'food_log', 'workout_logs': 'workout_log'}
+TDEE_GENDERS = [value for value, label in TdeeForm.gender.kwargs['choices']]
+TDEE_ACTIVITY_LEVELS = [value for value, label in TdeeForm.activity_level.kwargs['choices']]
+
+def hash_api_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def api_error(message, status, **extra):
+    return jsonify({'error': message, **extra}), status
+
+def api_token_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        header = request.headers.get('Authorization', '')
+        token = None
+        if header.startswith('Bearer '):
+            token = ApiToken.query.filter_by(token_hash=hash_api_token(header[7:].strip())).first()
+        if token is None:
+            response = jsonify({'error': 'missing or invalid token'})
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response, 401
+        now = datetime.utcnow()
+        if token.last_used_at is None or now - token.last_used_at > API_TOKEN_TOUCH_INTERVAL:
+            token.last_used_at = now
+            db.session.commit()
+        g.api_user_id = token.user_id
+        g.api_token_id = token.id
+        return view(*args, **kwargs)
+    return wrapper
+
+def api_response(payload, status=200):
+    # GETs carry an etag of the body, so a client that already has the data gets an empty 304 back
+    response = jsonify(payload)
+    response.status_code = status
+    if request.method == 'GET':
+        response.add_etag()
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.make_conditional(request)
+    return response
+
+def get_api_resource(resource):
+    if resource not in API_RESOURCES:
+        abort(404)
+    return LOG_TYPES[API_RESOURCES[resource]]
+
+def api_fields(fields):
+    # ?fields=calories,log_date trims every item down to those columns (the id is always included)
+    requested = request.args.get('fields')
+    if not requested:
+        return list(fields)
+    selected = [field.strip() for field in requested.split(',') if field.strip()]
+    unknown = [field for field in selected if field not in fields and field != 'id']
+    if unknown:
+        response = jsonify({'error': 'unknown fields: ' + ', '.join(unknown)})
+        response.status_code = 400
+        abort(response)
+    return [field for field in selected if field != 'id']
+
+def api_log_dict(log, fields):
+    item = {'id': log.id}
+    for field in fields:
+        value = getattr(log, field)
+        item[field] = value.isoformat() if isinstance(value, datetime) else value
+    return item
+
+def parse_client_timestamp(value):
+    # updated_at as the client saw it, only used to decide last writer wins
+    if value is None:
+        return None
+    try:
+        timestamp = parse_log_date(value)
+    except (TypeError, ValueError):
+        raise ValueError('updated_at: must be an ISO 8601 timestamp')
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)  # stored timestamps are naive utc
+    return timestamp
+
+def parse_api_values(fields, row, partial):
+    if not isinstance(row, dict):
+        raise ValueError('expected an object')
+    unknown = [key for key in row if key not in fields and key not in ('id', 'updated_at')]
+    if unknown:
+        raise ValueError('unknown fields: ' + ', '.join(unknown))
+    values = {}
+    for field, parse in fields.items():
+        if field not in row:
+            if partial:
+                continue
+            if field == 'log_date':
+                values[field] = datetime.utcnow()
+                continue
+        try:
+            values[field] = parse(row.get(field))
+        except (TypeError, ValueError) as error:
+            raise ValueError(f'{field}: {error}')
+    return values, parse_client_timestamp(row.get('updated_at'))
+
+def parse_api_id(row):
+    log_id = row.get('id') if isinstance(row, dict) else row
+    if not isinstance(log_id, int) or isinstance(log_id, bool):
+        raise ValueError('id: must be an integer')
+    return log_id
+
+def client_wins(log, client_updated_at):
+    # last writer wins. a change without a timestamp always applies, one older than the stored row loses
+    return client_updated_at is None or log.updated_at is None or client_updated_at >= log.updated_at
+
+def apply_api_batch(model, fields, user_id, create=None, update=None, delete=None):
+    # everything is validated before anything is written, then the whole batch goes out in one transaction.
+    # updates and deletes that lose to a newer stored change are skipped and come back as conflicts
+    create, update, delete = (ops if ops is not None else [] for ops in (create, update, delete))
+    if not all(isinstance(ops, list) for ops in (create, update, delete)):
+        return None, api_error('create, update and delete must be lists', 400)
+    if len(create) + len(update) + len(delete) > API_BATCH_LIMIT:
+        return None, api_error(f'at most {API_BATCH_LIMIT} operations per batch', 400)
+    errors = []
+    creates = []
+    for index, row in enumerate(create):
+        try:
+            creates.append(parse_api_values(fields, row, partial=False))
+        except ValueError as error:
+            errors.append({'op': 'create', 'index': index, 'error': str(error)})
+    updates = []
+    for index, row in enumerate(update):
+        try:
+            log_id = parse_api_id(row)
+            updates.append((log_id, *parse_api_values(fields, row, partial=True)))
+        except ValueError as error:
+            errors.append({'op': 'update', 'index': index, 'error': str(error)})
+    deletes = []
+    for index, row in enumerate(delete):
+        # either a bare id or {"id": ..., "updated_at": ...}
+        try:
+            log_id = parse_api_id(row)
+            deletes.append((log_id, parse_client_timestamp(row.get('updated_at')) if isinstance(row, dict) else None))
+        except ValueError as error:
+            errors.append({'op': 'delete', 'index': index, 'error': str(error)})
+    if errors:
+        return None, api_error('validation failed', 400, details=errors)
+
+    # tombstones are looked up too, an offline client may still be editing a row someone else deleted
+    wanted = {log_id for log_id, *rest in updates} | {log_id for log_id, updated_at in deletes}
+    existing = {}
+    if wanted:
+        existing = {log.id: log for log in model.query.filter(model.user_id == user_id, model.id.in_(wanted))}
+    missing = sorted(wanted - existing.keys())
+    if missing:
+        archived = sorted(find_archived_logs(model, user_id, missing))
+        if len(archived) < len(missing):
+            return None, api_error('not found', 404, ids=sorted(set(missing) - set(archived)))
+        return None, api_error('archived rows are read only', 409, ids=archived)
+
+    # the summary deltas of the whole batch are collected and go out summed per day at the end
+    summary_change = SUMMARY_CHANGES[model]
+    summary_changes = []
+    created = []
+    for values, updated_at in creates:
+        log = model(user_id=user_id, updated_at=updated_at, **values)
+        db.session.add(log)
+        summary_changes.append(summary_change(log))
+        created.append(log)
+    updated = []
+    conflicts = []
+    for log_id, values, updated_at in updates:
+        log = existing[log_id]
+        if not client_wins(log, updated_at):
+            conflicts.append(log)
+            continue
+        if log.deleted_at is None:
+            summary_changes.append(summary_change(log, -1))
+        else:
+            log.deleted_at = None  # an edit newer than the delete brings the row back
+        for field, value in values.items():
+            setattr(log, field, value)
+        if updated_at is not None:
+            log.updated_at = updated_at
+            flag_modified(log, 'updated_at')  # a timestamp equal to the stored one is still the client's, see stamp_sync_versions
+        summary_changes.append(summary_change(log))
+        updated.append(log)
+    deleted = []
+    for log_id, updated_at in deletes:
+        log = existing[log_id]
+        if log.deleted_at is None:
+            if not client_wins(log, updated_at):
+                conflicts.append(log)
+                continue
+            summary_changes.append(summary_change(log, -1))
+            log.deleted_at = datetime.utcnow()
+            if updated_at is not None:
+                log.updated_at = updated_at
+                flag_modified(log, 'updated_at')
+        deleted.append(log_id)  # deleting a tombstone again is a no-op, retries are safe
+    add_to_daily_summaries(model, user_id, summary_changes)
+    if model is FoodLog:
+        remember_foods(user_id, created + updated)
+    db.session.flush()
+    returned = [log.id for log in created + updated + conflicts]
+    db.session.commit()
+    if returned:
+        # the commit expired every row, reading them back for the response would be a SELECT each
+        model.query.filter(model.id.in_(returned)).all()
+    return (created, updated, deleted, conflicts), None
+
+def sync_log_dict(log, fields):
+    item = api_log_dict(log, fields)
+    item['version'] = log.version
+    item['updated_at'] = log.updated_at.isoformat() if log.updated_at else None
+    item['deleted'] = log.deleted_at is not None
+    item['archived'] = log.archived  # archived rows can't be updated or deleted
+    return item
+
+@bp.route('/api/v1/tokens', methods=['POST'])
+def create_api_token():
+    data = request.get_json(silent=True) or {}
+    username, password = data.get('username'), data.get('password')
+    if not isinstance(username, str) or not isinstance(password, str):
+        return api_error('username and password are required', 400)
+    check_login_allowed(username)  # same limits and lockout as the login form
+    user = User.query.filter_by(username=username).first()
+    if user is None or not password_hasher.check(user.password, password):
+        record_login_failure(username)
+        return api_error('invalid username or password', 401)
+    clear_login_failures(username)
+    token = secrets.token_urlsafe(32)
+    api_token = ApiToken(user_id=user.id, name=str(data.get('name') or 'mobile')[:100], token_hash=hash_api_token(token))
+    db.session.add(api_token)
+    db.session.commit()
+    # the token itself is only ever shown here, the table keeps its hash
+    return jsonify({'id': api_token.id, 'token': token, 'name': api_token.name}), 201
+
+@bp.route('/api/v1/tokens/current', methods=['DELETE'])
+@api_token_required
+def revoke_api_token():
+    ApiToken.query.filter_by(id=g.api_token_id).delete()
+    db.session.commit()
+    return '', 204
+
+@bp.route('/api/v1/<resource>', methods=['GET'])
+@api_token_required
+def api_list_logs(resource):
+    model, fields = get_api_resource(resource)
+    selected = api_fields(fields)
+    logs, next_cursor, _ = paginate_logs(model, g.api_user_id)
+    return api_response({'items': [api_log_dict(log, selected) for log in logs], 'next_cursor': next_cursor})
+
+@bp.route('/api/v1/<resource>/<int:log_id>', methods=['GET'])
+@api_token_required
+def api_get_log(resource, log_id):
+    model, fields = get_api_resource(resource)
+    log = model.query.filter_by(id=log_id, user_id=g.api_user_id, deleted_at=None).first()
+    if log is None:
+        log = find_archived_logs(model, g.api_user_id, [log_id]).get(log_id)
+    if log is None:
+        abort(404)
+    return api_response(api_log_dict(log, api_fields(fields)))
+
+@bp.route('/api/v1/<resource>', methods=['POST'])
+@api_token_required
+def api_create_log(resource):
+    model, fields = get_api_resource(resource)
+    result, error = apply_api_batch(model, fields, g.api_user_id, create=[request.get_json(silent=True)])
+    if error:
+        return error
+    return api_response(api_log_dict(result[0][0], api_fields(fields)), 201)
+
+@bp.route('/api/v1/<resource>/<int:log_id>', methods=['PATCH'])
+@api_token_required
+def api_update_log(resource, log_id):
+    model, fields = get_api_resource(resource)
+    row = request.get_json(silent=True)
+    if not isinstance(row, dict):
+        return api_error('expected an object', 400)
+    result, error = apply_api_batch(model, fields, g.api_user_id, update=[{**row, 'id': log_id}])
+    if error:
+        return error
+    created, updated, deleted, conflicts = result
+    if conflicts:
+        return jsonify({'error': 'a newer change is already stored', 'current': sync_log_dict(conflicts[0], list(fields))}), 409
+    return api_response(api_log_dict(updated[0], api_fields(fields)))
+
+@bp.route('/api/v1/<resource>/<int:log_id>', methods=['DELETE'])
+@api_token_required
+def api_delete_log(resource, log_id):
+    model, fields = get_api_resource(resource)
+    result, error = apply_api_batch(model, fields, g.api_user_id, delete=[log_id])
+    if error:
+        return error
+    return '', 204
+
+@bp.route('/api/v1/<resource>/batch', methods=['POST'])
+@api_token_required
+def api_batch_logs(resource):
+    # {"create": [{...}], "update": [{"id": 1, ...}], "delete": [2, 3]} - all of it applies or none of it does
+    model, fields = get_api_resource(resource)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return api_error('expected an object with create, update and/or delete', 400)
+    result, error = apply_api_batch(model, fields, g.api_user_id, data.get('create', []),
+                                    data.get('update', []), data.get('delete', []))
+    if error:
+        return error
+    created, updated, deleted, conflicts = result
+    selected = api_fields(fields)
+    return api_response({'created': [sync_log_dict(log, selected) for log in created],
+                         'updated': [sync_log_dict(log, selected) for log in updated],
+                         'deleted': deleted,
+                         'conflicts': [sync_log_dict(log, list(fields)) for log in conflicts]})
+
+# delta sync. every write to a log row stamps it with the user's next version (stamp_sync_versions), so
+# "what changed since I last synced" is one index range scan on (user_id, version, id) per table.
+# the cursor holds a (version, id) position per table, ties are possible since imports share one version.
+# pages of the initial download carry an 'i.' prefix: their positions are wherever the download has got to,
+# often far below sync_floor, and tombstones purged before the download started don't matter to it
+SYNC_INITIAL_PREFIX = 'i.'
+SYNC_RESOURCES = ('food_logs', 'workout_logs')
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 2000
+DEFAULT_CONFIG['SYNC_TOMBSTONE_DAYS'] = 90  # tombstones older than this are purged, clients further behind resync from scratch
+
+def encode_sync_cursor(positions, initial=False):
+    return (SYNC_INITIAL_PREFIX if initial else '') + '.'.join(f'{version}.{log_id}' for version, log_id in positions)
+
+def decode_sync_cursor(cursor):
+    # -> (positions, initial)
+    initial = cursor.startswith(SYNC_INITIAL_PREFIX)
+    if initial:
+        cursor = cursor[len(SYNC_INITIAL_PREFIX):]
+    try:
+        numbers = [cursor_int(part) for part in cursor.split('.')]
+    except ValueError:
+        abort(400)
+    if len(numbers) != 2 * len(SYNC_RESOURCES):
+        abort(400)
+    return list(zip(numbers[::2], numbers[1::2])), initial
+
+@bp.route('/api/v1/sync')
+@api_token_required
+def api_sync():
+    # without ?since= this is the initial download of every live row (archived ones included), with it only the
+    # rows changed after the cursor plus ids of deleted ones. keep calling with the returned cursor while "more" is true
+    limit = min(max(request.args.get('limit', SYNC_PAGE_SIZE, type=int) or SYNC_PAGE_SIZE, 1), SYNC_MAX_PAGE_SIZE)
+    since = request.args.get('since')
+    positions, initial = decode_sync_cursor(since) if since else ([(-1, 0)] * len(SYNC_RESOURCES), True)
+    high_water, floor = db.session.query(User.sync_version, User.sync_floor).filter_by(id=g.api_user_id).one()
+    if not initial and floor and any(version <= floor for version, log_id in positions):
+        return api_error('cursor is older than the kept tombstones, sync again without since', 410)
+
+    payload = {}
+    next_positions = []
+    more = False
+    for resource, (version, log_id) in zip(SYNC_RESOURCES, positions):
+        model, fields = get_api_resource(resource)
+        query = model.query.filter(model.user_id == g.api_user_id,
+                                   db.or_(model.version > version, db.and_(model.version == version, model.id > log_id)))
+        if not since:
+            query = query.filter(model.deleted_at.is_(None))
+        logs = query.order_by(model.version, model.id).limit(limit + 1).all()
+        archived = archived_sync_logs(model, g.api_user_id, version, log_id, limit + 1)
+        if archived:
+            logs = sorted(logs + archived, key=lambda log: (log.version, log.id))[:limit + 1]
+        if len(logs) > limit:
+            logs = logs[:limit]
+            more = True
+            next_positions.append((logs[-1].version, logs[-1].id))
+        elif logs and logs[-1].version > high_water:
+            next_positions.append((logs[-1].version, logs[-1].id))
+        else:
+            # caught up: every version up to high_water has been seen, later commits always get a higher one
+            next_positions.append((high_water + 1, 0))
+        payload[resource] = {'changed': [sync_log_dict(log, list(fields)) for log in logs if log.deleted_at is None],
+                             'deleted': [log.id for log in logs if log.deleted_at is not None]}
+    payload['cursor'] = encode_sync_cursor(next_positions, initial and more)  # the last page hands out a delta cursor
+    payload['more'] = more
+    return api_response(payload)
+
+def purge_tombstones(older_than):
+    # remembers the highest purged version per user as sync_floor, cursors at or below it can't be served any more
+    floors = {}
+    purged = 0
+    for model in SYNCED_MODELS:
+        stale = model.deleted_at < older_than
+        for user_id, version in db.session.query(model.user_id, db.func.max(model.version)).filter(stale).group_by(model.user_id):
+            floors[user_id] = max(floors.get(user_id, 0), version)
+        purged += model.query.filter(stale).delete(synchronize_session=False)
+    for user_id, version in floors.items():
+        user = db.session.get(User, user_id)
+        user.sync_floor = max(user.sync_floor, version)
+    db.session.commit()
+    return purged
+
+@bp.cli.command('purge-tombstones')
+@click.option('--days', type=int, default=None, help='keep tombstones younger than this (default: SYNC_TOMBSTONE_DAYS)')
+@schema_required
+def purge_tombstones_command(days):
+    days = current_app.config['SYNC_TOMBSTONE_DAYS'] if days is None else days
+    click.echo(f'Purged {purge_tombstones(datetime.utcnow() - timedelta(days=days))} deleted log entries.')
+
+def api_body_numbers(data, names):
+    values = {}
+    for name in names:
+        value = data.get(name)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value <= 0:
+            raise ValueError(f'{name}: must be a positive number')
+        values[name] = float(value)
+    return values
+
+@bp.route('/api/v1/bmi', methods=['GET', 'POST'])
+@api_token_required
+def api_bmi():
+    user = db.session.get(User, g.api_user_id)
+    if request.method == 'POST':
+        # same units as the bmi form, weight in kg and height in cm
+        try:
+            values = api_body_numbers(request.get_json(silent=True) or {}, ('weight', 'height'))
+        except ValueError as error:
+            return api_error(str(error), 400)
+        user.bmi = calculate_bmi(values['height'] / 100, values['weight'])
+        user.bmi_date = datetime.utcnow()
+        db.session.commit()
+    return api_response({'bmi': user.bmi, 'bmi_date': user.bmi_date.isoformat() if user.bmi_date else None})
+
+@bp.route('/api/v1/tdee', methods=['GET', 'POST'])
+@api_token_required
+def api_tdee():
+    user = db.session.get(User, g.api_user_id)
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if data.get('gender') not in TDEE_GENDERS:
+            return api_error('gender: must be one of ' + ', '.join(TDEE_GENDERS), 400)
+        if data.get('activity_level') not in TDEE_ACTIVITY_LEVELS:
+            return api_error('activity_level: must be one of ' + ', '.join(TDEE_ACTIVITY_LEVELS), 400)
+        try:
+            values = api_body_numbers(data, ('weight', 'height', 'age'))
+        except ValueError as error:
+            return api_error(str(error), 400)
+        user.tdee = calculate_tdee(data['gender'], values['height'], values['weight'], values['age'], data['activity_level'])
+        user.tdee_date = datetime.utcnow()
+        db.session.commit()
+    return api_response({'tdee': user.tdee, 'tdee_date': user.tdee_date.isoformat() if user.tdee_date else None})
+
+def init_schema():
+    # creates missing tables, columns and indexes and loads the bundled foods. it inspects every table,
+    # which is why a production master runs it once before forking rather than each worker on its first request
+    db.create_all()
+    upgrade_schema()
+    if FoodItem.query.filter_by(source='bundled').first() is None:
+        load_bundled_foods()
+
+@bp.cli.command('init-db')
+def init_db_command():
+    # the commands run through the factory from this directory, e.g. flask --app app init-db, or
+    # flask --app app rebuild-summaries. each one sets up a fresh database itself, this one only does that
+    init_schema()
+    click.echo('Database schema is up to date.')
+
+init_lock = threading.Lock()
+
+def lazy_init_schema():
+    state = app_state()
+    if state.schema_ready or not current_app.config['SCHEMA_AUTO_INIT']:
+        return
+    with init_lock:
+        if not state.schema_ready:
+            init_schema()
+            state.schema_ready = True
+
+DEFAULT_CONFIG['ASSET_MAX_AGE'] = 365 * 24 * 3600  # fingerprinted urls never change content, so browsers keep them for a year
+DEFAULT_CONFIG['COMPRESS_MIN_SIZE'] = 1024          # bytes, below this the headers and cpu cost more than the saving
+DEFAULT_CONFIG['COMPRESS_LEVEL'] = 6                # gzip level for responses, static assets are compressed once at 9
+DEFAULT_CONFIG['BROTLI_QUALITY'] = 5
+DEFAULT_CONFIG['COMPRESS_MIMETYPES'] = {'text/html', 'text/css', 'text/plain', 'text/csv', 'application/json',
+                                    'application/javascript', 'image/svg+xml'}
+FINGERPRINT_PATTERN = re.compile(r'^(.+)\.[0-9a-f]{12}(\.[^./]+)$')
+assets = None
+
+def build_assets():
+    # everything under static/ keyed by its path, with the fingerprinted url (content hash in the file name) and the
+    # body already compressed in every encoding we serve, so a request for an asset is a dict lookup
+    built = {}
+    for root, dirs, files in os.walk(current_app.static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as asset_file:
+                data = asset_file.read()
+            logical = os.path.relpath(path, current_app.static_folder).replace(os.sep, '/')
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            stem, extension = os.path.splitext(logical)
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            bodies = {'identity': data}
+            if mimetype in current_app.config['COMPRESS_MIMETYPES'] and len(data) >= current_app.config['COMPRESS_MIN_SIZE']:
+                bodies['gzip'] = gzip.compress(data, 9, mtime=0)
+                if brotli is not None:
+                    bodies['br'] = brotli.compress(data, quality=11)
+            built[logical] = SimpleNamespace(path=f'{stem}.{digest}{extension}', digest=digest, mimetype=mimetype, bodies=bodies)
+    return built
+
+def get_assets():
+    global assets
+    if current_app.debug:
+        return build_assets()  # pick up edits without a restart
+    if assets is None:
+        with init_lock:
+            if assets is None:
+                assets = build_assets()
+    return assets
+
+def asset_url(name):
+    return url_for('kickstart.asset', filename=get_assets()[name].path)
+
+def negotiate_encoding(available):
+    # brotli beats gzip when the client takes both, q=0 rules an encoding out
+    accepted = request.accept_encodings
+    for encoding in ('br', 'gzip'):
+        if encoding in available and accepted.quality(encoding) > 0:
+            return encoding
+    return None
+
+@bp.route('/assets/<path:filename>')
+def asset(filename):
+    match = FINGERPRINT_PATTERN.match(filename)
+    found = get_assets().get(match.group(1) + match.group(2)) if match else None
+    if found is None:
+        abort(404)
+    encoding = negotiate_encoding(found.bodies)
+    response = Response(found.bodies[encoding or 'identity'], mimetype=found.mimetype)
+    if len(found.bodies) > 1:
+        response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(f'{found.digest}-{encoding}' if encoding else found.digest)
+    if filename == found.path:
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['ASSET_MAX_AGE']
+        response.cache_control.immutable = True
+    else:
+        # a page rendered before a deploy asking for the old version, serve what we have but don't let it stick
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+class AssetAwareSessionInterface(SecureCookieSessionInterface):
+    def save_session(self, app, session, response):
+        # flask-login reads the session after every request, which adds "Vary: Cookie". assets are the same for
+        # everybody and never touch the session, varying them on the cookie would make browsers refetch after a login
+        if request.endpoint != 'kickstart.asset':
+            super().save_session(app, session, response)
+
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.mimetype not in current_app.config['COMPRESS_MIMETYPES']):
+        return response  # files and streamed exports go out as they are
+    response.vary.add('Accept-Encoding')
+    if current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token') in g:
+        # the page embeds the session's csrf token next to text the user controls, compressing it would let an
+        # attacker recover the token from the response sizes (BREACH). those are small form pages anyway
+        return response
+    encoding = negotiate_encoding(('br', 'gzip') if brotli is not None else ('gzip',))
+    data = response.get_data()
+    if encoding is None or len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=current_app.config['BROTLI_QUALITY']))
+    else:
+        response.set_data(gzip.compress(data, current_app.config['COMPRESS_LEVEL'], mtime=0))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)  # same representation, different bytes, conditional requests still match
+    return response
+
+def warm_caches():
+    # the work a worker's first request would otherwise do: compiling every template, configuring the
+    # mappers, building the url map and fingerprinting/compressing the static assets. run before forking,
+    # the workers share the result copy-on-write
+    for name in current_app.jinja_env.list_templates():
+        current_app.jinja_env.get_template(name)
+    get_assets()
+    configure_mappers()
+    current_app.url_map.bind('localhost').match('/')
+
+def init_hooks(app):
+    # app wide handlers for the routes in bp, registered per app the same way init_instrumentation does it
+    app.register_error_handler(HashingBusy, hashing_busy)
+    app.register_error_handler(RateLimited, rate_limited)
+    app.before_request(lazy_init_schema)
+    app.after_request(compress_response)
+    app.add_template_global(asset_url)
+    app.session_interface = AssetAwareSessionInterface()
+
+def create_app(config=None):
+    # builds a new app on every call: DEFAULT_CONFIG, then config (a dict or an object with upper case
+    # attributes), then the extensions, the routes in bp and the hooks. each app has its own engines, caches
+    # and rate limit store, so a test can make one per database. the cli finds it too: flask --app app ...
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    if config:
+        if not isinstance(config, dict):
+            config = {key: getattr(config, key) for key in dir(config) if key.isupper()}
+        app.config.update(config)
+        if 'SQLALCHEMY_DATABASE_URI' in config and 'SQLALCHEMY_ENGINE_OPTIONS' not in config:
+            # pool settings depend on which database it is
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(config['SQLALCHEMY_DATABASE_URI'])
+    if not app.config['SECRET_KEY']:
+        app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+    if not app.config['SECRET_KEY']:
+        # sessions signed with a throwaway key only survive until a restart and only work with one process,
+        # fine for the dev server. gunicorn.conf.py refuses to start without SECRET_KEY
+        app.logger.warning('SECRET_KEY is not set, using a random key for this process')
+        app.config['SECRET_KEY'] = secrets.token_hex(32)
+    db.init_app(app)
+    bcrypt.init_app(app)
+    login_manager.init_app(app)
+    init_instrumentation(app)
+    caches = {name: LRUCache(**arguments) for name, arguments in APP_CACHES.items()}
+    caches['user'] = LRUCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+    app.extensions['kickstart'] = SimpleNamespace(caches=caches, rate_limit_store=None, schema_ready=False)
+    app.register_blueprint(bp)
+    init_hooks(app)
+    return app
+
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
-        db.create_all()
+        init_schema()
     app.run(debug=True)
@@ -0,0 +1,361 @@
+# benchmark and load test for the main routes and the calculation functions
+#
+#   python benchmark.py                          # seed a throwaway sqlite db and print the results
+#   python benchmark.py --save-baseline          # store the results as the new baseline
+#   python benchmark.py --rows 100000 --threads 8
+#
+# exits with status 1 when a scenario runs more queries per request or sends a bigger response than the
+# stored baseline, both are the same on any machine so it can sit in CI next to the app. timings depend on
+# the hardware, so they are compared as multiples of a reference workload timed in the same run and only
+# reported, unless --strict-timings makes a slowdown fail too (for a CI runner that is always the same box)
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(APP_DIR, 'benchmark_baseline.json')
+PASSWORD = 'benchpass'
+BROWSER_ENCODINGS = 'gzip, deflate, br'
+FOODS = ['Oats', 'Chicken Breast', 'Rice', 'Eggs', 'Banana', 'Greek Yogurt', 'Salmon', 'Broccoli']
+EXERCISES = ['Running', 'Cycling', 'Squats', 'Bench Press', 'Rowing', 'Swimming']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the KickStart routes and calculators.')
+    parser.add_argument('--users', type=int, default=3, help='synthetic users to create')
+    parser.add_argument('--rows', type=int, default=20000, help='food log rows per user (workout rows are a quarter of this)')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route scenario')
+    parser.add_argument('--login-requests', type=int, default=20, help='login requests (each one is a full bcrypt check)')
+    parser.add_argument('--threads', type=int, default=4, help='threads used by the load generator')
+    parser.add_argument('--calc-iterations', type=int, default=20000, help='calls per calculator scenario')
+    parser.add_argument('--startup-runs', type=int, default=5, help='fresh interpreters started per startup scenario')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline json file')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed timing slowdown, relative to the reference (0.25 = 25%%)')
+    parser.add_argument('--strict-timings', action='store_true', help='fail on timing slowdowns too, not just report them')
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args()
+
+
+def database_uri(workdir):
+    return 'sqlite:///' + os.path.join(workdir, 'benchmark.db')
+
+def load_app(workdir):
+    sys.path.insert(0, APP_DIR)
+    import app as kickstart
+    application = kickstart.create_app({
+        'SQLALCHEMY_DATABASE_URI': database_uri(workdir),
+        'WTF_CSRF_ENABLED': False,
+        'RATE_LIMIT_ENABLED': False,  # the login scenario is one client hammering one account
+        'SCHEMA_AUTO_INIT': False,    # seed() builds the schema itself
+    })
+    return kickstart, application
+
+
+def seed(kickstart, app, args):
+    random.seed(args.seed)
+    db = kickstart.db
+    usernames = []
+    with app.app_context():
+        db.create_all()
+        kickstart.upgrade_schema()
+        password = kickstart.bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+        start = datetime.utcnow() - timedelta(days=3 * 365)
+        for number in range(args.users):
+            user = kickstart.User(username=f'bench{number:04d}', password=password, bmi=23.4, bmi_date=datetime.utcnow(),
+                                  tdee=2400, tdee_date=datetime.utcnow())
+            db.session.add(user)
+            db.session.flush()
+            step = (datetime.utcnow() - start) / max(args.rows, 1)
+            food_rows = [{'user_id': user.id, 'food_name': random.choice(FOODS), 'quantity': random.uniform(50, 300),
+                          'calories': random.uniform(50, 700), 'protein': random.uniform(0, 50), 'carbs': random.uniform(0, 80),
+                          'fats': random.uniform(0, 30), 'log_date': start + step * i} for i in range(args.rows)]
+            workout_rows = [{'user_id': user.id, 'exercise_name': random.choice(EXERCISES), 'duration': random.uniform(15, 90),
+                             'intensity': random.choice(['Low', 'Medium', 'High']), 'log_date': start + step * i * 4}
+                            for i in range(args.rows // 4)]
+            for batch_start in range(0, len(food_rows), 5000):
+                db.session.execute(db.insert(kickstart.FoodLog), food_rows[batch_start:batch_start + 5000])
+            for batch_start in range(0, len(workout_rows), 5000):
+                db.session.execute(db.insert(kickstart.WorkoutLog), workout_rows[batch_start:batch_start + 5000])
+            usernames.append(user.username)
+        db.session.commit()
+        kickstart.rebuild_daily_summaries()
+    return usernames
+
+
+class QueryCounter:
+    def __init__(self, kickstart, app):
+        self.count = 0
+        with app.app_context():
+            kickstart.db.event.listen(kickstart.db.engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, *args):
+        self.count += 1
+
+
+def logged_in_client(app, username):
+    client = app.test_client()
+    response = client.post('/login', data={'username': username, 'password': PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError(f'could not log in as {username} (status {response.status_code})')
+    return client
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(name, latencies, queries=None, peak_bytes=None, wall=None, response_bytes=None):
+    result = {
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'samples': len(latencies),
+    }
+    if queries is not None:
+        result['queries_per_request'] = queries
+    if peak_bytes is not None:
+        result['peak_memory_kb'] = peak_bytes / 1024
+    if wall:
+        result['throughput_rps'] = len(latencies) / wall
+    if response_bytes is not None:
+        result['response_kb'] = response_bytes / 1024
+    return name, result
+
+
+def measure_route(client, path, method='get', data=None, headers=None):
+    started = time.perf_counter()
+    response = getattr(client, method)(path, data=data, headers=headers)
+    elapsed = time.perf_counter() - started
+    if response.status_code >= 400:
+        raise RuntimeError(f'{method.upper()} {path} returned {response.status_code}')
+    return elapsed, len(response.data)
+
+
+def single_client_scenario(counter, name, client, path, requests, method='get', data=None):
+    measure_route(client, path, method, data)  # warm up caches and compiled templates
+    before = counter.count
+    latencies = [measure_route(client, path, method, data)[0] for _ in range(requests)]
+    queries = (counter.count - before) / requests
+    tracemalloc.start()
+    measure_route(client, path, method, data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    sent = measure_route(client, path, method, data, headers={'Accept-Encoding': BROWSER_ENCODINGS})[1]  # what a browser downloads
+    return summarize(name, latencies, queries, peak, response_bytes=sent)
+
+
+def load_scenario(name, clients, paths, requests):
+    # every thread has its own logged in client, they all hammer the same mix of routes
+    def worker(client):
+        timings = []
+        for number in range(requests // len(clients)):
+            timings.append(measure_route(client, paths[number % len(paths)])[0])
+        return timings
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+        latencies = [timing for timings in pool.map(worker, clients) for timing in timings]
+    return summarize(name, latencies, wall=time.perf_counter() - started)
+
+
+def reference_workload(rows):
+    # interpreter, sqlite and json work in roughly the mix a request does, with no app code in it
+    connection = sqlite3.connect(':memory:')
+    connection.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT, value REAL)')
+    connection.executemany('INSERT INTO item VALUES (?, ?, ?)', rows)
+    fetched = connection.execute('SELECT name, value FROM item ORDER BY value DESC').fetchall()
+    connection.close()
+    return json.dumps(sorted({name: round(value, 2) for name, value in fetched}.items()))
+
+
+def reference_scenario(runs=30):
+    # the fastest of many runs, that is the least disturbed by whatever else the machine is doing
+    rows = [(number, f'{random.choice(FOODS)} {number}', number * 1.5 % 977) for number in range(2000)]
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        reference_workload(rows)
+        timings.append(time.perf_counter() - started)
+    return 'reference', {'reference_ms': min(timings) * 1000}
+
+
+def calculator_scenario(name, func, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    per_call = (time.perf_counter() - started) / iterations
+    return name, {'mean_us': per_call * 1e6, 'samples': iterations}
+
+
+# runs in a fresh interpreter: import + create_app (+ warm_caches) and then the first two requests,
+# which is what every worker goes through after a deploy
+STARTUP_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import app as kickstart
+application = kickstart.create_app({'SQLALCHEMY_DATABASE_URI': sys.argv[2], 'SCHEMA_AUTO_INIT': False})
+if sys.argv[3] == 'warm':
+    with application.app_context():
+        kickstart.warm_caches()
+ready = time.perf_counter()
+client = application.test_client()
+timings = []
+for _ in range(2):
+    request_started = time.perf_counter()
+    client.get('/login')
+    timings.append(time.perf_counter() - request_started)
+print(json.dumps({'startup_ms': (ready - started) * 1000, 'first_request_ms': timings[0] * 1000,
+                  'second_request_ms': timings[1] * 1000}))
+'''
+
+
+def startup_scenario(name, workdir, mode, runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, APP_DIR, database_uri(workdir), mode],
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.splitlines()[-1]))
+    return name, {metric: statistics.median(sample[metric] for sample in samples) for metric in samples[0]}
+
+
+def deep_history_path(client, endpoint, pages):
+    # follow the "older entries" cursor a few pages in, keyset pages should cost the same as the first
+    path = f'/{endpoint}'
+    for _ in range(pages):
+        body = client.get(path).get_data(as_text=True)
+        marker = 'cursor='
+        if marker not in body:
+            break
+        cursor = body.split(marker, 1)[1].split('&', 1)[0].split('"', 1)[0]
+        path = f'/{endpoint}?cursor={cursor}'
+    return path
+
+
+def run(kickstart, app, args, usernames, workdir):
+    counter = QueryCounter(kickstart, app)
+    results = dict([reference_scenario()])
+    client = logged_in_client(app, usernames[0])
+
+    for name, path in [('dashboard', '/dashboard'),
+                       ('food_log_history', '/food_log_history'),
+                       ('food_log_history_deep', deep_history_path(client, 'food_log_history', 20)),
+                       ('workout_log_history', '/workout_log_history')]:
+        key, result = single_client_scenario(counter, name, client, path, args.requests)
+        results[key] = result
+
+    login_client = app.test_client()
+    key, result = single_client_scenario(counter, 'login', login_client, '/login', args.login_requests,
+                                         method='post', data={'username': usernames[0], 'password': PASSWORD})
+    results[key] = result
+
+    clients = [logged_in_client(app, usernames[number % len(usernames)]) for number in range(args.threads)]
+    key, result = load_scenario('load_mixed', clients,
+                                ['/dashboard', '/food_log_history', '/workout_log_history'], args.requests * args.threads)
+    results[key] = result
+
+    assessment = SimpleNamespace(age=34, current_weight=82.5, goal_weight=76.0, training_preference='hybrid', tdee=2450.0)
+    for name, func in [('calculate_tdee', lambda: kickstart.calculate_tdee('female', 168, 64, 31, 'moderately_active')),
+                       ('calculate_volume', lambda: kickstart.calculate_volume(82.5, 76.0, 'hybrid', 34)),
+                       ('generate_workout_plan', lambda: kickstart.generate_workout_plan(assessment))]:
+        key, result = calculator_scenario(name, func, args.calc_iterations)
+        results[key] = result
+
+    for name, mode in [('startup_cold', 'cold'), ('startup_warm', 'warm')]:
+        key, result = startup_scenario(name, workdir, mode, args.startup_runs)
+        results[key] = result
+    # timed again at the end, the lower of the two in case the cpu clocked up or down during the run
+    results['reference']['reference_ms'] = min(results['reference']['reference_ms'], reference_scenario()[1]['reference_ms'])
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # -> (failures, slowdowns). queries and response size are failures on their own, timings are divided
+    # by each run's reference time first so a faster or slower machine doesn't look like a regression
+    failures = []
+    slowdowns = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if 'queries_per_request' in previous and result.get('queries_per_request', 0) > previous['queries_per_request']:
+            failures.append(f'{name}: {result["queries_per_request"]:.1f} queries per request > baseline {previous["queries_per_request"]:.1f}')
+        if 'response_kb' in previous and result.get('response_kb', 0) > previous['response_kb'] * 1.01:
+            failures.append(f'{name}: {result["response_kb"]:.2f} KB sent > baseline {previous["response_kb"]:.2f}')
+    if 'reference' not in baseline:
+        slowdowns.append('the baseline has no reference time, timings were not compared (run --save-baseline)')
+        return failures, slowdowns
+    speed = baseline['reference']['reference_ms'] / results['reference']['reference_ms']  # > 1 on a faster machine
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous or name == 'reference':
+            continue
+        for metric in ('p95_ms', 'mean_us', 'startup_ms', 'first_request_ms'):
+            if metric in result and metric in previous and result[metric] * speed > previous[metric] * (1 + tolerance):
+                slowdowns.append(f'{name}: {metric} {result[metric] * speed:.2f} (scaled to the baseline machine) > '
+                                 f'baseline {previous[metric]:.2f} (+{tolerance:.0%})')
+    return failures, slowdowns
+
+
+def print_results(results):
+    print(f'{"scenario":<24}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"queries":>10}{"peak KB":>10}{"req/s":>10}{"us/call":>10}'
+          f'{"start ms":>10}{"1st req":>10}{"KB sent":>10}')
+    for name, result in results.items():
+        if name == 'reference':
+            continue
+        cells = [result.get(metric) for metric in
+                 ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request', 'peak_memory_kb', 'throughput_rps', 'mean_us',
+                  'startup_ms', 'first_request_ms', 'response_kb')]
+        print(f'{name:<24}' + ''.join(f'{cell:>10.2f}' if cell is not None else f'{"-":>10}' for cell in cells))
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        kickstart, app = load_app(workdir)
+        started = time.perf_counter()
+        usernames = seed(kickstart, app, args)
+        print(f'seeded {args.users} users x {args.rows} food rows in {time.perf_counter() - started:.1f}s')
+        results = run(kickstart, app, args, usernames, workdir)
+        with app.app_context():
+            kickstart.db.engine.dispose()
+    print_results(results)
+    print(f'reference workload {results["reference"]["reference_ms"]:.2f} ms')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print(f'baseline written to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print('no baseline yet, run with --save-baseline to create one')
+        return 0
+    with open(args.baseline) as baseline_file:
+        failures, slowdowns = compare(results, json.load(baseline_file), args.tolerance)
+    if args.strict_timings:
+        failures += slowdowns
+        slowdowns = []
+    for slowdown in slowdowns:
+        print('SLOWER', slowdown)
+    for failure in failures:
+        print('REGRESSION', failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
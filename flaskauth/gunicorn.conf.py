@@ -0,0 +1,56 @@
+# production entry point, run from this directory (gunicorn picks this file up on its own):
+#
+#   pip install -r requirements.txt
+#   SECRET_KEY=... gunicorn
+#   SECRET_KEY=... JOBS_ASYNC=1 gunicorn          # imports, exports and assessments go to the job queue,
+#   SECRET_KEY=... JOBS_ASYNC=1 flask --app app run-worker   # which needs this running next to it
+#                                                 # (without JOBS_ASYNC=1 every job runs inside its request)
+#   kill -HUP <master pid>     # reload the config and replace the workers gracefully (the code stays as loaded)
+#   kill -USR2 <master pid>    # deploy new code: starts a new master next to the old one, then
+#   kill -TERM <old master>    # stop the old master once the new one is serving
+#
+# the master imports the app, upgrades the schema and compiles every template before forking (preload_app),
+# so the workers start with warm caches shared copy-on-write and the first request after a deploy doesn't
+# pay for any of it. gunicorn is unix only
+import multiprocessing
+import os
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+if not os.environ.get('SECRET_KEY'):
+    # the key signs the session cookies, a missing or well known one lets anybody log in as any user
+    raise SystemExit('SECRET_KEY is not set, generate one with: python -c "import secrets; print(secrets.token_hex(32))"')
+
+# rate limits kept in one worker's memory would be multiplied by the worker count, keep them in a sqlite
+# file every worker on the host shares. read by the app at import time, so it has to be set before preloading
+os.environ.setdefault('RATE_LIMIT_STORE_PATH', os.path.join(APP_DIR, 'instance', 'rate_limits.db'))
+os.makedirs(os.path.dirname(os.environ['RATE_LIMIT_STORE_PATH']), exist_ok=True)
+
+# the schema is set up once in on_starting, not on the first request of every worker
+wsgi_app = "app:create_app({'SCHEMA_AUTO_INIT': False})"
+chdir = APP_DIR
+bind = os.environ.get('BIND', '127.0.0.1:8000')
+backlog = 2048
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() or 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))  # requests mostly wait on the database or the bcrypt pool
+preload_app = True
+graceful_timeout = 30  # seconds a stopping worker gets to finish its requests
+timeout = 60
+
+
+def on_starting(server):
+    # runs in the master after the app was preloaded and before any worker is forked
+    import app as kickstart
+    application = server.app.wsgi()
+    with application.app_context():
+        kickstart.init_schema()
+        kickstart.warm_caches()
+        kickstart.db.engine.dispose()  # every worker opens its own connections after the fork
+
+
+def post_fork(server, worker):
+    # threads don't survive a fork, the profiler has to be started again in each worker
+    from instrumentation import profiler
+    if server.app.wsgi().config['PROFILER_ENABLED']:
+        profiler.start()
@@ -0,0 +1,254 @@
+# per request timing, sql query counting and template render timing, exposed as prometheus text at /metrics
+# everything checks METRICS_ENABLED first, so with it switched off each hook is a single dict lookup
+import hmac
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from flask import Response, abort, before_render_template, current_app, g, has_app_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+sql_log = logging.getLogger('kickstart.sql')
+request_log = logging.getLogger('kickstart.requests')
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}'
+        yield f'{name}_sum{format_labels(labels)} {self.sum}'
+        yield f'{name}_count{format_labels(labels)} {self.count}'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels) + '}'
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_latency = defaultdict(Histogram)   # (endpoint, method, status) -> seconds
+        self.request_queries = defaultdict(Histogram)   # endpoint -> queries per request
+        self.template_latency = defaultdict(Histogram)  # template name -> seconds
+        self.query_latency = Histogram()
+        self.slow_queries = 0
+        self.n_plus_one = Counter()                     # endpoint -> requests over the query threshold
+        self.collectors = []                            # callables returning (name, help, type, value) tuples
+
+    def observe_request(self, endpoint, method, status, seconds, queries):
+        with self.lock:
+            self.request_latency[(endpoint, method, status)].observe(seconds)
+            self.request_queries[endpoint].observe(queries)
+
+    def observe_query(self, seconds, slow):
+        with self.lock:
+            self.query_latency.observe(seconds)
+            if slow:
+                self.slow_queries += 1
+
+    def observe_template(self, name, seconds):
+        with self.lock:
+            self.template_latency[name].observe(seconds)
+
+    def flag_n_plus_one(self, endpoint):
+        with self.lock:
+            self.n_plus_one[endpoint] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            lines += ['# HELP kickstart_request_seconds Request latency by route.',
+                      '# TYPE kickstart_request_seconds histogram']
+            for (endpoint, method, status), histogram in sorted(self.request_latency.items()):
+                lines += histogram.lines('kickstart_request_seconds',
+                                         (('endpoint', endpoint), ('method', method), ('status', status)))
+            lines += ['# HELP kickstart_request_queries SQL statements per request by route.',
+                      '# TYPE kickstart_request_queries histogram']
+            for endpoint, histogram in sorted(self.request_queries.items()):
+                lines += histogram.lines('kickstart_request_queries', (('endpoint', endpoint),))
+            lines += ['# HELP kickstart_query_seconds SQL statement latency.',
+                      '# TYPE kickstart_query_seconds histogram']
+            lines += self.query_latency.lines('kickstart_query_seconds', ())
+            lines += ['# HELP kickstart_slow_queries_total SQL statements slower than SLOW_QUERY_MS.',
+                      '# TYPE kickstart_slow_queries_total counter',
+                      f'kickstart_slow_queries_total {self.slow_queries}']
+            lines += ['# HELP kickstart_n_plus_one_total Requests that ran more than N_PLUS_ONE_THRESHOLD statements.',
+                      '# TYPE kickstart_n_plus_one_total counter']
+            for endpoint, count in sorted(self.n_plus_one.items()):
+                lines.append(f'kickstart_n_plus_one_total{format_labels((("endpoint", endpoint),))} {count}')
+            lines += ['# HELP kickstart_template_seconds Template render time.',
+                      '# TYPE kickstart_template_seconds histogram']
+            for name, histogram in sorted(self.template_latency.items()):
+                lines += histogram.lines('kickstart_template_seconds', (('template', name),))
+        for collector in self.collectors:
+            for name, help_text, metric_type, value in collector():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    # samples every thread's stack on a timer, output is in collapsed stack format for flamegraph tools
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.samples.clear()
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f'{code.co_filename.rsplit("/", 1)[-1]}:{code.co_name}')
+                    frame = frame.f_back
+                with self.lock:
+                    self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        with self.lock:
+            return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+
+metrics = Metrics()
+profiler = SamplingProfiler()
+
+
+# the engine events are process wide, so they are hooked once here rather than per app. they look up the
+# settings of whichever app is handling the query
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and current_app.config.get('METRICS_ENABLED'):
+        conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    timers = conn.info.get('metrics_query_started')
+    if not timers:
+        return
+    elapsed = time.perf_counter() - timers.pop()
+    slow = elapsed * 1000 > current_app.config['SLOW_QUERY_MS']
+    metrics.observe_query(elapsed, slow)
+    if slow:
+        sql_log.warning('slow query (%.1f ms): %s', elapsed * 1000, statement)
+    if 'metrics_queries' in g:
+        g.metrics_queries += 1
+        g.metrics_query_seconds += elapsed
+
+
+def init_instrumentation(app):
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('METRICS_TOKEN', None)       # /metrics needs "Authorization: Bearer <token>", without a token it's off
+    app.config.setdefault('SLOW_QUERY_MS', 100)
+    app.config.setdefault('N_PLUS_ONE_THRESHOLD', 20)   # statements per request before it gets logged as a likely N+1
+    app.config.setdefault('PROFILER_ENABLED', False)
+    config = app.config
+
+    @app.before_request
+    def start_request_timer():
+        if config['METRICS_ENABLED']:
+            g.metrics_started = time.perf_counter()
+            g.metrics_queries = 0
+            g.metrics_query_seconds = 0.0
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unknown'
+        queries = g.metrics_queries
+        metrics.observe_request(endpoint, request.method, response.status_code, elapsed, queries)
+        if queries > config['N_PLUS_ONE_THRESHOLD']:
+            metrics.flag_n_plus_one(endpoint)
+            request_log.warning('%s ran %d SQL statements, probably an N+1 query', endpoint, queries)
+        response.headers['Server-Timing'] = 'app;dur=%.1f, db;dur=%.1f' % (elapsed * 1000, g.metrics_query_seconds * 1000)
+        return response
+
+    @before_render_template.connect_via(app)
+    def start_template_timer(sender, template, context, **extra):
+        if config['METRICS_ENABLED']:
+            g.setdefault('metrics_templates', []).append(time.perf_counter())
+
+    @template_rendered.connect_via(app)
+    def record_template(sender, template, context, **extra):
+        timers = g.get('metrics_templates')
+        if timers:
+            metrics.observe_template(template.name or 'string', time.perf_counter() - timers.pop())
+
+    def check_token():
+        # the metrics name every route and the profiler costs cpu and shows code paths, so neither is public
+        token = config['METRICS_TOKEN']
+        if not token:
+            abort(404)
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(403)
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        check_token()
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/metrics/profiler', methods=['GET', 'POST'])
+    def sampling_profiler():
+        # POST action=start|stop toggles the profiler, GET returns the collapsed stacks collected so far
+        check_token()
+        if request.method == 'POST':
+            action = request.values.get('action')
+            if action == 'start':
+                profiler.start()
+            elif action == 'stop':
+                profiler.stop()
+            else:
+                abort(400)
+            return {'running': profiler.running}
+        return Response(profiler.collapsed(), mimetype='text/plain')
+
+    if config['PROFILER_ENABLED']:
+        profiler.start()
@@ -0,0 +1,52 @@
+# the app is a single module imported as `app` from the flaskauth directory, the same way gunicorn.conf.py loads it
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')  # the cost only matters in production, keep test logins fast
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    # apps on one sqlite file in tmp_path, each with its own caches like separate worker processes would have
+    import app as kickstart
+    apps = []
+
+    def make_app(**config):
+        app = kickstart.create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "test.db"}', 'SECRET_KEY': 'test',
+                                    'WTF_CSRF_ENABLED': False, 'SCHEMA_AUTO_INIT': False, **config})
+        with app.app_context():
+            kickstart.init_schema()
+        apps.append(app)
+        return app
+
+    yield make_app
+    for app in apps:
+        with app.app_context():
+            kickstart.db.engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    # a fresh app on its own sqlite file, so each test starts from an empty database and empty caches
+    return make_app()
+
+
+@pytest.fixture
+def user_id(app):
+    import app as kickstart
+    with app.app_context():
+        user = kickstart.User(username='tester', password=kickstart.password_hasher.hash('secret1'))
+        kickstart.db.session.add(user)
+        kickstart.db.session.commit()
+        return user.id
+
+
+@pytest.fixture
+def api(app, user_id):
+    client = app.test_client()
+    token = client.post('/api/v1/tokens', json={'username': 'tester', 'password': 'secret1'}).get_json()['token']
+    client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer ' + token
+    return client
@@ -0,0 +1,76 @@
+# cold history: archived months have to read back exactly like the hot rows they replaced, in keyset pages,
+# exports and the food catalog, and stay read only
+import json
+
+import pytest
+
+import app as kickstart
+
+# two archived months, a recent month that stays hot, and later a hot row backdated into the archived range
+DATES = ['2023-01-05T08:00:00', '2023-01-05T08:00:00', '2023-01-20T12:00:00', '2023-02-01T07:30:00',
+         '2023-02-14T19:00:00', '2099-01-02T10:00:00', '2099-01-03T10:00:00']
+
+
+def food(name, log_date):
+    return {'food_name': name, 'quantity': 200, 'calories': 300, 'protein': 10, 'carbs': 40, 'fats': 8, 'log_date': log_date}
+
+
+@pytest.fixture
+def logs(app, api, user_id):
+    created = api.post('/api/v1/food_logs/batch', json={'create': [food(f'Food {number}', log_date) for number, log_date
+                                                                   in enumerate(DATES)]}).get_json()['created']
+    with app.app_context():
+        assert kickstart.archive_logs(days=30) == 5
+        assert kickstart.FoodLog.query.count() == 2
+    backdated = api.post('/api/v1/food_logs', json=food('Backdated', '2023-01-10T09:00:00')).get_json()
+    return [(row['log_date'], row['id']) for row in created + [backdated]]
+
+
+def walk_pages(api, per_page):
+    rows, cursor = [], None
+    while True:
+        page = api.get('/api/v1/food_logs', query_string={'per_page': per_page, **({'cursor': cursor} if cursor else {})}).get_json()
+        rows += [(row['log_date'], row['id']) for row in page['items']]
+        cursor = page['next_cursor']
+        if not cursor:
+            return rows
+
+
+@pytest.mark.parametrize('per_page', [1, 2, 3, 50])
+def test_keyset_pages_merge_archived_and_hot_rows(api, logs, per_page):
+    assert walk_pages(api, per_page) == sorted(logs, reverse=True)
+
+
+def test_date_filters_reach_into_the_archive(api, logs):
+    page = api.get('/api/v1/food_logs', query_string={'start': '2023-01-06', 'end': '2023-02-01'}).get_json()
+    assert [row['food_name'] for row in page['items']] == ['Food 3', 'Food 2', 'Backdated']
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'ndjson'])
+def test_export_is_in_date_order_across_archive_and_hot_rows(app, user_id, logs, fmt):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+    body = client.get(f'/export/food_log?format={fmt}').get_data(as_text=True)
+    if fmt == 'csv':
+        exported = [int(line.split(',', 1)[0]) for line in body.splitlines()[1:]]
+    else:
+        exported = [json.loads(line)['id'] for line in body.splitlines()]
+    assert exported == [log_id for log_date, log_id in sorted(logs)]
+
+
+def test_catalog_rebuild_includes_archived_foods(app, user_id, logs):
+    with app.app_context():
+        assert kickstart.load_user_foods() == len(DATES) + 1
+        item = kickstart.FoodItem.query.filter_by(user_id=user_id, name='Food 0').one()
+        assert (item.calories, item.protein) == (150, 5)  # per 100g
+        assert [result['name'] for result in kickstart.search_foods(user_id, 'food 2')] == ['Food 2']
+
+
+def test_archived_rows_are_read_only(api, logs):
+    archived_id = logs[0][1]
+    assert api.get(f'/api/v1/food_logs/{archived_id}').get_json()['food_name'] == 'Food 0'
+    response = api.patch(f'/api/v1/food_logs/{archived_id}', json={'calories': 1})
+    assert response.status_code == 409 and response.get_json()['ids'] == [archived_id]
+    assert api.delete(f'/api/v1/food_logs/{archived_id}').status_code == 409
+    assert api.delete('/api/v1/food_logs/999999').status_code == 404
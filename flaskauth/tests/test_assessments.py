@@ -0,0 +1,50 @@
+# batch_generate_workout_plans promises bit for bit the same plans as generate_workout_plan, these pin that down
+import itertools
+import random
+from types import SimpleNamespace
+
+import pytest
+
+import app as kickstart
+
+# both sides of every age and weight boundary in calculate_intensity, calculate_volume and workout_sessions_per_week
+AGES = (18, 29, 29.5, 30, 39, 39.9, 40, 49, 50, 50.5, 51, 64, 100)
+WEIGHTS = ((80, 70), (70, 80), (75, 75), (30, 30.1), (150.25, 149.75))
+TDEES = (1500, 2000.05, 2333.3333, 3100.5)
+
+
+def scalar_plans(clients):
+    return [kickstart.generate_workout_plan(SimpleNamespace(age=age, current_weight=current_weight, goal_weight=goal_weight,
+                                                            training_preference=training_preference, tdee=tdee))
+            for age, current_weight, goal_weight, training_preference, tdee in clients]
+
+
+def batch_plans(clients):
+    return kickstart.batch_generate_workout_plans(*(list(column) for column in zip(*clients)))
+
+
+@pytest.fixture(autouse=True)
+def empty_assessment_cache():
+    kickstart.assessment_cache.clear()
+
+
+def test_batch_matches_scalar_across_boundaries():
+    clients = [(age, current_weight, goal_weight, training_preference, tdee)
+               for age, (current_weight, goal_weight), training_preference, tdee
+               in itertools.product(AGES, WEIGHTS, kickstart.TRAINING_PREFERENCES, TDEES)]
+    assert batch_plans(clients) == scalar_plans(clients)
+
+
+def test_batch_matches_scalar_for_random_rosters():
+    generator = random.Random(20240305)
+    clients = [(generator.randint(18, 100), round(generator.uniform(30, 200), 1), round(generator.uniform(30, 200), 1),
+                generator.choice(kickstart.TRAINING_PREFERENCES), round(generator.uniform(1200, 4500), 2))
+               for _ in range(2000)]
+    assert batch_plans(clients) == scalar_plans(clients)
+
+
+def test_repeated_clients_come_from_the_cache():
+    client = (35, 90, 80, 'hybrid', 2600)
+    first = batch_plans([client, client])
+    assert first[0] == first[1] == scalar_plans([client])[0]
+    assert batch_plans([client]) == first[:1]  # served from assessment_cache, still identical
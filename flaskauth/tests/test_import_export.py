@@ -0,0 +1,81 @@
+# bulk import and export. the import is authenticated by the session cookie, so these check what a cross-site
+# page could send: csrf protected multipart uploads, and raw bodies only in types a plain form can't produce
+import io
+import json
+import re
+
+import pytest
+
+import app as kickstart
+
+CSV = 'food_name,quantity,calories,protein,carbs,fats,log_date\nOats,100,389,16.9,66.3,6.9,2024-03-05T08:00:00\n' \
+      'Eggs,120,186,15.1,1.3,12.7,2024-03-05T09:00:00\n'
+
+
+@pytest.fixture
+def client(make_app, user_id):
+    app = make_app(WTF_CSRF_ENABLED=True)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def csrf_token(client):
+    page = client.get('/food_log').get_data(as_text=True)
+    return re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+
+
+def upload(client, body, filename='food.csv', **form):
+    return client.post('/import/food_log', data={'file': (io.BytesIO(body.encode()), filename), **form},
+                       content_type='multipart/form-data')
+
+
+def food_names(client):
+    return [row['food_name'] for row in map(json.loads, client.get('/export/food_log?format=ndjson').get_data(as_text=True).splitlines())]
+
+
+def test_multipart_upload_needs_the_csrf_token(client):
+    response = upload(client, CSV)
+    assert response.status_code == 400 and 'CSRF' in response.get_json()['error']
+    assert upload(client, CSV, csrf_token='forged').status_code == 400
+    assert food_names(client) == []
+
+    response = upload(client, CSV, csrf_token=csrf_token(client))
+    assert response.status_code == 200 and response.get_json()['imported'] == 2
+    assert food_names(client) == ['Oats', 'Eggs']
+
+
+@pytest.mark.parametrize('content_type', ['text/plain', 'application/x-www-form-urlencoded', 'application/octet-stream'])
+def test_bodies_a_cross_site_form_can_send_are_refused(client, content_type):
+    response = client.post('/import/food_log', data=CSV, content_type=content_type)
+    assert response.status_code == 415 and 'Content-Type' in response.get_json()['error']
+    assert food_names(client) == []
+
+
+def test_raw_csv_and_ndjson_bodies_need_no_token(client):
+    # a cross-site page can only send these types with a cors preflight, which we never answer
+    assert client.post('/import/food_log', data=CSV, content_type='text/csv; charset=utf-8').get_json()['imported'] == 2
+    ndjson = json.dumps({'food_name': 'Rice', 'quantity': 150, 'calories': 195, 'protein': 4, 'carbs': 42,
+                         'fats': 0.4, 'log_date': '2024-03-06T12:00:00'}) + '\n'
+    assert client.post('/import/food_log', data=ndjson, content_type='application/x-ndjson').get_json()['imported'] == 1
+    assert food_names(client) == ['Oats', 'Eggs', 'Rice']
+
+
+def test_a_bad_row_rejects_the_whole_import(client):
+    response = client.post('/import/food_log', data=CSV + 'Toast,50,nan,1,1,1,2024-03-05T10:00:00\n', content_type='text/csv')
+    assert response.status_code == 400 and response.get_json()['line'] == 4
+    assert food_names(client) == []
+
+
+def test_export_round_trips_through_import(client, app, user_id):
+    client.post('/import/food_log', data=CSV, content_type='text/csv')
+    exported = client.get('/export/food_log?format=csv')
+    assert exported.mimetype == 'text/csv'
+    assert exported.headers['Content-Disposition'] == 'attachment; filename=food_log.csv'
+    with app.app_context():
+        kickstart.FoodLog.query.delete()
+        kickstart.db.session.commit()
+    assert client.post('/import/food_log', data=exported.get_data(), content_type='text/csv').get_json()['imported'] == 2
+    assert food_names(client) == ['Oats', 'Eggs']
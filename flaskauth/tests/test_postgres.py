@@ -0,0 +1,141 @@
+# runs the model, daily summary and sync paths against the database in DATABASE_URL when that is postgres,
+# and skips otherwise. it only touches rows belonging to the users it creates, so a shared database is fine:
+#
+#   DATABASE_URL=postgresql://kickstart@localhost/kickstart_test python -m pytest tests
+import os
+import threading
+import uuid
+from datetime import date, datetime
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not os.environ.get('DATABASE_URL', '').startswith(('postgres://', 'postgresql')),
+                                reason='DATABASE_URL is not a postgres database')
+
+
+@pytest.fixture(scope='module')
+def kickstart():
+    import app as kickstart
+    kickstart.create_app({'SQLALCHEMY_DATABASE_URI': kickstart.database_uri(), 'WTF_CSRF_ENABLED': False,
+                          'SCHEMA_AUTO_INIT': False})
+    with app.app_context():
+        kickstart.init_schema()
+    return kickstart
+
+
+@pytest.fixture
+def user_id(kickstart, app):
+    with app.app_context():
+        user = kickstart.User(username='pg-' + uuid.uuid4().hex[:12], password=kickstart.password_hasher.hash('secret1'))
+        kickstart.db.session.add(user)
+        kickstart.db.session.commit()
+        user_id = user.id
+    yield user_id
+    with app.app_context():
+        kickstart.delete_food_items(kickstart.FoodItem.query.filter_by(user_id=user_id))
+        for model in (kickstart.FoodLog, kickstart.WorkoutLog, kickstart.DailySummary, kickstart.Job, kickstart.LogArchive,
+                      kickstart.ApiToken, kickstart.Assessment, kickstart.CacheVersion):
+            model.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+        kickstart.User.query.filter_by(id=user_id).delete(synchronize_session=False)
+        kickstart.db.session.commit()
+
+
+@pytest.fixture
+def api(kickstart, app, user_id):
+    client = app.test_client()
+    with app.app_context():
+        username = kickstart.db.session.get(kickstart.User, user_id).username
+    token = client.post('/api/v1/tokens', json={'username': username, 'password': 'secret1'}).get_json()['token']
+    client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer ' + token
+    return client
+
+
+def food(**values):
+    row = {'food_name': 'Oats', 'quantity': 100, 'calories': 389, 'protein': 16.9, 'carbs': 66.3, 'fats': 6.9,
+           'log_date': '2024-03-05T08:00:00'}
+    row.update(values)
+    return row
+
+
+def test_models_round_trip_and_stamp_sync_versions(kickstart, app, user_id):
+    with app.app_context():
+        db = kickstart.db
+        food_log = kickstart.FoodLog(user_id=user_id, **{**food(), 'log_date': datetime(2024, 3, 5, 8)})
+        workout = kickstart.WorkoutLog(user_id=user_id, exercise_name='Run', duration=30, intensity='High',
+                                       log_date=datetime(2024, 3, 5, 18))
+        db.session.add_all([food_log, workout])
+        db.session.commit()
+        assert food_log.version == workout.version == 1  # one version per user per flush
+        food_log.calories = 400
+        db.session.commit()
+        assert food_log.version == 2
+        assert db.session.get(kickstart.User, user_id).sync_version == 2
+        assert kickstart.FoodLog.query.filter_by(user_id=user_id).one().calories == 400
+
+
+def test_daily_summary_upserts_from_concurrent_writers(kickstart, app, user_id):
+    day = datetime(2024, 3, 6, 12)
+    errors = []
+
+    def writer():
+        with app.app_context():
+            for _ in range(10):
+                try:
+                    log = kickstart.FoodLog(user_id=user_id, food_name='Rice', quantity=100, calories=10, protein=1,
+                                            carbs=2, fats=0.5, log_date=day)
+                    kickstart.db.session.add(log)
+                    kickstart.apply_food_to_summary(log)
+                    kickstart.db.session.commit()
+                except Exception as error:
+                    kickstart.db.session.rollback()
+                    errors.append(error)
+
+    threads = [threading.Thread(target=writer) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with app.app_context():
+        summary = kickstart.DailySummary.query.filter_by(user_id=user_id, day=day.date()).one()
+        assert (summary.food_entries, summary.calories, summary.carbs) == (40, 400, 80)
+        for log in kickstart.FoodLog.query.filter_by(user_id=user_id):
+            kickstart.apply_food_to_summary(log, -1)
+        kickstart.db.session.commit()
+        summary = kickstart.DailySummary.query.filter_by(user_id=user_id, day=day.date()).one()
+        assert (summary.food_entries, summary.calories, summary.fats) == (0, 0, 0)
+
+
+def test_summaries_match_a_rebuild(kickstart, app, user_id, api):
+    api.post('/api/v1/food_logs/batch', json={'create': [food(), food(calories=120.5, log_date='2024-03-05T20:00:00'),
+                                                         food(log_date='2024-03-07T08:00:00')]})
+    api.post('/api/v1/workout_logs', json={'exercise_name': 'Squat', 'duration': 45, 'intensity': 'Medium',
+                                           'log_date': '2024-03-05T18:00:00'})
+    columns = ('day', 'calories', 'protein', 'food_entries', 'workout_minutes', 'medium_minutes')
+
+    def summaries():
+        rows = kickstart.DailySummary.query.filter_by(user_id=user_id).order_by(kickstart.DailySummary.day)
+        return [tuple(round(value, 6) if isinstance(value, float) else value for value in (getattr(row, column) for column in columns))
+                for row in rows]
+
+    with app.app_context():
+        incremental = summaries()
+        kickstart.rebuild_daily_summaries(user_id)
+        assert summaries() == incremental
+    assert incremental[0][:2] == (date(2024, 3, 5), 509.5)
+
+
+def test_sync_download_and_deltas(kickstart, app, user_id, api):
+    created = api.post('/api/v1/food_logs/batch', json={'create': [food(), food(food_name='Eggs')]}).get_json()['created']
+    initial = api.get('/api/v1/sync').get_json()
+    assert sorted(row['id'] for row in initial['food_logs']['changed']) == sorted(row['id'] for row in created)
+    assert not initial['more']
+
+    api.patch(f'/api/v1/food_logs/{created[0]["id"]}', json={'calories': 350})
+    api.delete(f'/api/v1/food_logs/{created[1]["id"]}')
+    delta = api.get('/api/v1/sync', query_string={'since': initial['cursor']}).get_json()
+    assert [(row['id'], row['calories']) for row in delta['food_logs']['changed']] == [(created[0]['id'], 350)]
+    assert delta['food_logs']['deleted'] == [created[1]['id']]
+
+    caught_up = api.get('/api/v1/sync', query_string={'since': delta['cursor']}).get_json()
+    assert caught_up['food_logs'] == {'changed': [], 'deleted': []}
@@ -0,0 +1,85 @@
+# login rate limits and lockout, on both stores and through the login form and token endpoint
+import pytest
+
+import app as kickstart
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return kickstart.MemoryRateLimitStore()
+    return kickstart.SqliteRateLimitStore(str(tmp_path / 'rate_limits.db'))
+
+
+def test_bucket_allows_a_burst_then_refills(store):
+    assert [store.take('ip:1', 3, 60, 1000.0)[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = store.take('ip:1', 3, 60, 1000.0)
+    assert not allowed and retry_after == pytest.approx(20)  # one token every 20 seconds
+    assert store.take('ip:2', 3, 60, 1000.0)[0]  # other keys have their own bucket
+    assert not store.take('ip:1', 3, 60, 1019.0)[0]
+    assert store.take('ip:1', 3, 60, 1021.0)[0]
+    assert [store.take('ip:1', 3, 60, 5000.0)[0] for _ in range(4)] == [True, True, True, False]  # full again, never more
+
+
+def test_failures_slide_out_of_the_window(store):
+    for at in (100.0, 200.0, 300.0):
+        store.add_failure('lockout:alice', 250, at)
+    assert store.failures('lockout:alice', 300.0 - 250) == [100.0, 200.0, 300.0]
+    store.add_failure('lockout:alice', 250, 400.0)  # trims everything at or before 150
+    assert store.failures('lockout:alice', 0) == [200.0, 300.0, 400.0]
+    store.clear_failures('lockout:alice')
+    assert store.failures('lockout:alice', 0) == []
+
+
+def login(client, username, password):
+    return client.post('/login', data={'username': username, 'password': password})
+
+
+def test_lockout_after_failed_logins(make_app):
+    app = make_app(LOCKOUT_FAILURES=3, RATE_LIMIT_PER_USERNAME=(100, 60))
+    client = app.test_client()
+    client.post('/register', data={'username': 'alice', 'password': 'secret1'})
+    assert [login(client, 'alice', 'wrong').status_code for _ in range(3)] == [200, 200, 200]
+
+    locked = login(client, ' Alice ', 'secret1')  # usernames are keyed case and space insensitive
+    assert locked.status_code == 429 and 850 < int(locked.headers['Retry-After']) <= 900
+    token = client.post('/api/v1/tokens', json={'username': 'alice', 'password': 'secret1'})
+    assert token.status_code == 429 and token.get_json() == {'error': 'too many attempts, try again later'}
+    assert login(client, 'bob', 'wrong').status_code == 200  # only that username is locked
+
+
+def test_a_successful_login_clears_the_failures(make_app):
+    app = make_app(LOCKOUT_FAILURES=3, RATE_LIMIT_PER_USERNAME=(100, 60))
+    client = app.test_client()
+    client.post('/register', data={'username': 'alice', 'password': 'secret1'})
+    login(client, 'alice', 'wrong')
+    login(client, 'alice', 'wrong')
+    assert login(client, 'alice', 'secret1').status_code == 302
+    login(client, 'alice', 'wrong')
+    login(client, 'alice', 'wrong')
+    assert login(client, 'alice', 'secret1').status_code == 302
+
+
+def test_per_ip_bucket_covers_every_username(make_app):
+    app = make_app(RATE_LIMIT_PER_IP=(5, 60))
+    client = app.test_client()
+    statuses = [login(client, f'user{number}', 'wrong').status_code for number in range(6)]
+    assert statuses == [200] * 5 + [429]
+    other = app.test_client()
+    assert login(other, 'user0', 'wrong').status_code == 429  # same address
+    assert other.post('/login', data={'username': 'user0', 'password': 'wrong'},
+                      environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 200
+
+
+def test_workers_share_limits_through_the_sqlite_store(make_app, tmp_path):
+    # two apps stand in for two worker processes, each would have its own memory store
+    path = str(tmp_path / 'rate_limits.db')
+    first, second = (make_app(RATE_LIMIT_STORE_PATH=path, LOCKOUT_FAILURES=4, RATE_LIMIT_PER_USERNAME=(100, 60))
+                     for _ in range(2))
+    first.test_client().post('/register', data={'username': 'alice', 'password': 'secret1'})
+    login(first.test_client(), 'alice', 'wrong')
+    login(second.test_client(), 'alice', 'wrong')
+    login(first.test_client(), 'alice', 'wrong')
+    login(second.test_client(), 'alice', 'wrong')
+    assert login(first.test_client(), 'alice', 'secret1').status_code == 429
+    assert login(second.test_client(), 'alice', 'secret1').status_code == 429
@@ -0,0 +1,96 @@
+# delta sync against a temporary sqlite file: cursors, the tombstone floor and last writer wins
+from datetime import datetime, timedelta
+
+import app as kickstart
+
+
+def food(**values):
+    row = {'food_name': 'Oats', 'quantity': 100, 'calories': 389, 'protein': 16.9, 'carbs': 66.3, 'fats': 6.9,
+           'log_date': '2024-03-05T08:00:00'}
+    row.update(values)
+    return row
+
+
+def sync_all(api, since=None, limit=None):
+    # follows the cursor until "more" is false, -> (pages, changed food ids, deleted food ids, last cursor)
+    pages, changed, deleted = [], [], []
+    while True:
+        query = {key: value for key, value in (('since', since), ('limit', limit)) if value is not None}
+        response = api.get('/api/v1/sync', query_string=query)
+        assert response.status_code == 200, response.get_json()
+        page = response.get_json()
+        pages.append(page)
+        changed += [row['id'] for row in page['food_logs']['changed']]
+        deleted += page['food_logs']['deleted']
+        since = page['cursor']
+        if not page['more']:
+            return pages, changed, deleted, since
+
+
+def purge_deleted(app):
+    with app.app_context():
+        kickstart.FoodLog.query.filter(kickstart.FoodLog.deleted_at.isnot(None)).update(
+            {'deleted_at': datetime.utcnow() - timedelta(days=365)}, synchronize_session=False)
+        kickstart.db.session.commit()
+        return kickstart.purge_tombstones(datetime.utcnow() - timedelta(days=90))
+
+
+def test_initial_download_pages_past_the_tombstone_floor(app, api):
+    ids = [row['id'] for row in api.post('/api/v1/food_logs/batch', json={'create': [food() for _ in range(6)]}).get_json()['created']]
+    api.post('/api/v1/food_logs/batch', json={'update': [{'id': log_id, 'calories': 400} for log_id in ids[:4]]})
+    api.post('/api/v1/food_logs/batch', json={'delete': [ids[4]]})
+    assert purge_deleted(app) == 1  # the floor is now above the version the first rows were written with
+
+    pages, changed, deleted, cursor = sync_all(api, limit=2)
+    assert len(pages) == 3
+    assert all(page['cursor'].startswith('i.') for page in pages[:-1])
+    assert sorted(changed) == sorted(ids[:4] + ids[5:]) and deleted == []
+    assert not cursor.startswith('i.')  # the last page hands out an ordinary delta cursor
+    assert sync_all(api, since=cursor)[1:3] == ([], [])
+
+
+def test_rows_sharing_a_version_page_without_gaps_or_repeats(api):
+    # one batch is one flush, so all of its rows get the same version and only the id breaks the tie
+    ids = [row['id'] for row in api.post('/api/v1/food_logs/batch', json={'create': [food() for _ in range(5)]}).get_json()['created']]
+    assert len({row['version'] for row in api.get('/api/v1/sync').get_json()['food_logs']['changed']}) == 1
+    pages, changed, deleted, cursor = sync_all(api, limit=2)
+    assert len(pages) == 3 and changed == ids
+
+    more = [row['id'] for row in api.post('/api/v1/food_logs/batch', json={'create': [food() for _ in range(3)]}).get_json()['created']]
+    assert sync_all(api, since=cursor, limit=2)[1] == more
+
+
+def test_delta_cursor_below_the_tombstone_floor_is_gone(app, api):
+    ids = [row['id'] for row in api.post('/api/v1/food_logs/batch', json={'create': [food(), food()]}).get_json()['created']]
+    cursor = sync_all(api)[3]
+    api.delete(f'/api/v1/food_logs/{ids[0]}')
+    fresh = sync_all(api, since=cursor)
+    assert fresh[2] == [ids[0]]
+    purge_deleted(app)
+
+    # the old cursor would miss the purged delete, the one taken after it saw the delete and is still good
+    response = api.get('/api/v1/sync', query_string={'since': cursor})
+    assert response.status_code == 410
+    assert sync_all(api, since=fresh[3])[1:3] == ([], [])
+    assert sync_all(api)[1] == [ids[1]]  # a full resync starts over
+
+
+def test_last_writer_wins(api):
+    row = api.post('/api/v1/food_logs', json=food(updated_at='2024-03-05T12:00:00')).get_json()
+    log_id = row['id']
+    stale = api.post('/api/v1/food_logs/batch', json={'update': [{'id': log_id, 'calories': 1, 'updated_at': '2024-03-05T11:00:00'}]}).get_json()
+    assert stale['updated'] == [] and [(conflict['id'], conflict['calories']) for conflict in stale['conflicts']] == [(log_id, 389)]
+    assert api.patch(f'/api/v1/food_logs/{log_id}', json={'calories': 1, 'updated_at': '2024-03-05T11:00:00'}).status_code == 409
+
+    newer = api.patch(f'/api/v1/food_logs/{log_id}', json={'calories': 400, 'updated_at': '2024-03-05T13:00:00+01:00'})
+    assert newer.status_code == 200 and newer.get_json()['calories'] == 400  # 12:00 utc ties with the stored change and wins
+
+    stale_delete = api.post('/api/v1/food_logs/batch', json={'delete': [{'id': log_id, 'updated_at': '2024-03-05T10:00:00'}]}).get_json()
+    assert stale_delete['deleted'] == [] and stale_delete['conflicts'][0]['id'] == log_id
+    deleted = api.post('/api/v1/food_logs/batch', json={'delete': [{'id': log_id, 'updated_at': '2024-03-05T14:00:00'}]}).get_json()
+    assert deleted['deleted'] == [log_id]
+
+    # an offline edit made after the delete brings the row back
+    revived = api.post('/api/v1/food_logs/batch', json={'update': [{'id': log_id, 'calories': 420, 'updated_at': '2024-03-05T15:00:00'}]}).get_json()
+    assert [(row['id'], row['calories'], row['deleted']) for row in revived['updated']] == [(log_id, 420, False)]
+    assert [row['id'] for row in api.get('/api/v1/sync').get_json()['food_logs']['changed']] == [log_id]
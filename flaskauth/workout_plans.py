@@ -0,0 +1,228 @@
+# catalog of the fixed workout splits, one entry per (training preference, days per week)
+# these used to be nine near identical templates, workout_split.html renders any of them
+
+REST_DAY = {'name': 'Rest'}
+
+HIIT = {'name': 'HIIT', 'exercises': [
+    'Jump Squats: 4 sets x 20 seconds',
+    'Burpees: 4 sets x 20 seconds',
+    'Mountain Climbers: 4 sets x 20 seconds',
+    'High Knees: 4 sets x 20 seconds',
+    'Rest: 60 seconds between sets',
+]}
+
+TABATA = {'name': 'Tabata', 'exercises': [
+    'Jumping Jacks: 20 seconds on, 10 seconds off, 8 sets',
+    'Speed Skaters: 20 seconds on, 10 seconds off, 8 sets',
+    'Bicycle Crunches: 20 seconds on, 10 seconds off, 8 sets',
+    'Plank: 20 seconds on, 10 seconds off, 8 sets',
+]}
+
+STEADY_STATE_RUN = {'name': 'Steady State Cardio', 'exercises': ['Running: 40 minutes at moderate intensity']}
+
+LONG_DISTANCE = {'name': 'Long Distance Cardio', 'exercises': ['Cycling: 1 hour at moderate intensity']}
+
+CIRCUIT = {'name': 'Strength & Cardio - Circuit Training', 'exercises': [
+    'Squats: 3 sets x 10 reps',
+    'Push-ups: 3 sets x 10 reps',
+    'Box Jumps: 3 sets x 10 reps',
+    'Dumbbell Rows: 3 sets x 10 reps each arm',
+    'Jump Rope: 3 sets x 1 minute',
+]}
+
+INTERVALS = {'name': 'Cardio & Strength - Interval Training', 'exercises': [
+    'Sprints: 10 sets x 30 seconds on, 60 seconds off',
+    'Bodyweight Lunges: 3 sets x 15 reps each leg',
+    'Push Press: 3 sets x 10 reps',
+    'Plank: 3 sets x 45 seconds',
+]}
+
+PYRAMID_NOTE = ('Start with 10 reps of each: Squats, Push-ups, Sit-ups, Burpees. Decrease by 1 rep each round '
+                'until you reach 1 rep of each. Rest as needed between sets.')
+
+CARDIO_AND_CORE = {'name': 'Cardio & Core', 'exercises': [
+    'Running: 30 minutes at moderate intensity',
+    'Bicycle Crunches: 4 sets x 15 reps',
+    'Leg Raises: 4 sets x 12 reps',
+    'Russian Twists: 3 sets x 20 reps',
+]}
+
+FULL_BODY = {'name': 'Full Body', 'exercises': [
+    'Squats: 4 sets x 8 reps',
+    'Bench Press: 4 sets x 8 reps',
+    'Bent-over Rows: 4 sets x 8 reps',
+    'Deadlifts: 4 sets x 6 reps',
+    'Dumbbell Lunges: 3 sets x 10 reps each leg',
+    'Dumbbell Shoulder Press: 3 sets x 10 reps',
+    'Bicycle Crunches: 3 sets x 20 reps',
+]}
+
+WORKOUT_PLANS = {
+    ('cardio', '3'): {
+        'title': 'Cardio 3-Day Split',
+        'days': [
+            HIIT,
+            REST_DAY,
+            {'name': 'Steady State Cardio', 'exercises': ['Jogging: 30 minutes at moderate intensity']},
+            REST_DAY,
+            TABATA,
+        ],
+    },
+    ('cardio', '4'): {
+        'title': '4-Day Cardio Split',
+        'days': [HIIT, STEADY_STATE_RUN, TABATA, LONG_DISTANCE],
+    },
+    ('cardio', '5'): {
+        'title': '5-Day Cardio Split',
+        'days': [
+            HIIT,
+            STEADY_STATE_RUN,
+            TABATA,
+            LONG_DISTANCE,
+            {'name': 'Interval Training', 'exercises': [
+                'Sprints: 10 sets x 30 seconds on, 60 seconds off',
+                'Jump Rope: 5 sets x 1 minute',
+                'Mountain Climbers: 3 sets x 30 seconds',
+                'Burpees: 3 sets x 30 seconds',
+            ]},
+        ],
+    },
+    ('hybrid', '3'): {
+        'title': '3-Day Hybrid Split',
+        'days': [
+            CIRCUIT,
+            REST_DAY,
+            INTERVALS,
+            REST_DAY,
+            {'name': 'Strength & Cardio - Pyramid Workout', 'note': PYRAMID_NOTE},
+        ],
+    },
+    ('hybrid', '4'): {
+        'title': '4-Day Hybrid Split',
+        'days': [
+            CIRCUIT,
+            {'name': 'Cardio - Interval Training', 'exercises': [
+                'Sprints: 10 sets x 30 seconds on, 60 seconds off',
+                'Jumping Lunges: 3 sets x 15 reps each leg',
+                'Push Press: 3 sets x 10 reps',
+                'Plank: 3 sets x 45 seconds',
+            ]},
+            REST_DAY,
+            {'name': 'Strength - Pyramid Workout', 'note': PYRAMID_NOTE},
+            CARDIO_AND_CORE,
+        ],
+    },
+    ('hybrid', '5'): {
+        'title': '5-Day Hybrid Split',
+        'days': [
+            CIRCUIT,
+            INTERVALS,
+            FULL_BODY,
+            {'name': 'Strength & Cardio - Pyramid Workout', 'note': PYRAMID_NOTE},
+            CARDIO_AND_CORE,
+        ],
+    },
+    ('weight', '3'): {
+        'title': '3-Day Weight Intensive Split',
+        'days': [
+            {'name': 'Full Body', 'exercises': [
+                'Squats: 4 sets x 8 reps',
+                'Bench Press: 4 sets x 8 reps',
+                'Bent-over Rows: 4 sets x 8 reps',
+                'Deadlifts: 4 sets x 6 reps',
+                'Dumbbell Lunges: 3 sets x 10 reps each leg',
+                'Plank: 3 sets x 30 seconds',
+            ]},
+            REST_DAY,
+            {'name': 'Full Body', 'exercises': [
+                'Romanian Deadlifts: 4 sets x 8 reps',
+                'Military Press: 4 sets x 8 reps',
+                'Pull-ups: 4 sets x Max reps (or assisted pull-ups)',
+                'Dumbbell Chest Flyes: 3 sets x 10 reps',
+                'Leg Press: 4 sets x 10 reps',
+                'Russian Twists: 3 sets x 15 reps',
+            ]},
+            REST_DAY,
+            {'name': 'Full Body', 'exercises': [
+                'Front Squats: 4 sets x 8 reps',
+                'Incline Bench Press: 4 sets x 8 reps',
+                'Lat Pulldowns: 4 sets x 10 reps',
+                'Leg Curls: 3 sets x 12 reps',
+                'Dumbbell Shoulder Press: 3 sets x 10 reps',
+                'Bicycle Crunches: 3 sets x 20 reps',
+            ]},
+        ],
+    },
+    ('weight', '4'): {
+        'title': '4-Day Weight Split',
+        'days': [
+            {'name': 'Lower Body', 'exercises': [
+                'Squats: 4 sets x 8 reps',
+                'Romanian Deadlifts: 4 sets x 8 reps',
+                'Leg Press: 4 sets x 10 reps',
+                'Calf Raises: 3 sets x 12 reps',
+                'Plank: 3 sets x 30 seconds',
+            ]},
+            {'name': 'Upper Body', 'exercises': [
+                'Bench Press: 4 sets x 8 reps',
+                'Pull-ups: 4 sets x Max reps (or assisted pull-ups)',
+                'Military Press: 4 sets x 8 reps',
+                'Dumbbell Rows: 4 sets x 10 reps each arm',
+                'Russian Twists: 3 sets x 15 reps',
+            ]},
+            REST_DAY,
+            {'name': 'Lower Body', 'exercises': [
+                'Deadlifts: 4 sets x 6 reps',
+                'Leg Curls: 4 sets x 10 reps',
+                'Walking Lunges: 3 sets x 12 steps each leg',
+                'Seated Calf Raises: 3 sets x 15 reps',
+                'Plank: 3 sets x 30 seconds',
+            ]},
+            {'name': 'Upper Body', 'exercises': [
+                'Incline Bench Press: 4 sets x 8 reps',
+                'Lat Pulldowns: 4 sets x 10 reps',
+                'Dumbbell Shoulder Press: 4 sets x 8 reps',
+                'Cable Rows: 4 sets x 10 reps',
+                'Bicycle Crunches: 3 sets x 20 reps',
+            ]},
+        ],
+    },
+    ('weight', '5'): {
+        'title': '5-Day Weight Split',
+        'days': [
+            {'name': 'Upper Body', 'exercises': [
+                'Bench Press: 4 sets x 8 reps',
+                'Bent-over Rows: 4 sets x 8 reps',
+                'Military Press: 4 sets x 8 reps',
+                'Pull-ups: 4 sets x Max reps',
+                'Tricep Dips: 3 sets x 10 reps',
+                'Bicep Curls: 3 sets x 10 reps',
+            ]},
+            {'name': 'Lower Body', 'exercises': [
+                'Squats: 4 sets x 8 reps',
+                'Romanian Deadlifts: 4 sets x 8 reps',
+                'Leg Press: 4 sets x 10 reps',
+                'Walking Lunges: 3 sets x 12 steps each leg',
+                'Calf Raises: 3 sets x 15 reps',
+                'Plank: 3 sets x 30 seconds',
+            ]},
+            {'name': 'Upper Body', 'exercises': [
+                'Incline Bench Press: 4 sets x 8 reps',
+                'Lat Pulldowns: 4 sets x 10 reps',
+                'Shoulder Press: 4 sets x 8 reps',
+                'Seated Cable Rows: 4 sets x 10 reps',
+                'Skull Crushers: 3 sets x 10 reps',
+                'Hammer Curls: 3 sets x 10 reps',
+            ]},
+            {'name': 'Lower Body', 'exercises': [
+                'Deadlifts: 4 sets x 6 reps',
+                'Leg Curls: 4 sets x 10 reps',
+                'Bulgarian Split Squats: 3 sets x 10 reps each leg',
+                'Standing Calf Raises: 3 sets x 15 reps',
+                'Russian Twists: 3 sets x 20 reps',
+                'Plank: 3 sets x 30 seconds',
+            ]},
+            FULL_BODY,
+        ],
+    },
+}